@@ -0,0 +1,451 @@
+import time
+from collections import deque
+from concurrent.futures import TimeoutError as FutureTimeoutError, wait
+
+from common import *
+from connect import reply_ok
+from metrics import metrics
+
+
+# board.ino 的 loop() 只认识部分动作名, 其余动作展开成它能执行的命令行
+SERVO_DELAY = 10
+HEAD_OFFSET = 45
+action_commands = {
+    "head_left": f"head_move {-HEAD_OFFSET} 0 {SERVO_DELAY}",
+    "head_right": f"head_move {HEAD_OFFSET} 0 {SERVO_DELAY}",
+    "head_up": f"head_move 0 {-HEAD_OFFSET} {SERVO_DELAY}",
+    "head_down": f"head_move 0 {HEAD_OFFSET} {SERVO_DELAY}",
+    "head_roll_right": "head_roll",
+}
+
+# 在主机端执行的动作 (秒), 不发送给设备
+host_delays = {
+    "delay": 1.0,
+}
+
+# board.ino 中舵机的中心和活动范围 (度), head_move 每 servo_delay 毫秒转动 STEP 度
+X_CENTER = 130
+X_OFFSET = 25
+Y_CENTER = 70
+Y_OFFSET = 50
+STEP = 1
+CENTER = (X_CENTER, Y_CENTER)
+
+# 固件内置的头部动作展开成 head_move 序列 (x, y, servo_delay), "center" 表示 head_center()
+head_macros = {
+    "head_center": ["center"],
+    "head_nod": [(0, 40, 3), (0, -40, 3)] * 3,
+    "head_shake": [(-20, 0, 3)] + [(40, 0, 3), (-40, 0, 3)] * 2 + [(20, 0, 3)],
+    "head_roll": ["center", (0, Y_OFFSET // 2 + 5, SERVO_DELAY)] + [
+        (dx * X_OFFSET, dy * (Y_OFFSET // 2), 30)
+        for dx, dy in [(1, -1), (-1, -1), (-1, 1), (1, 1), (-1, -1), (1, -1), (1, 1), (-1, 1)]
+    ] + ["center"],
+}
+
+# 固件只有一种环绕 head_roll, 先转向右侧; 向左环绕在主机端展开成左右镜像的 head_move 序列
+action_commands["head_roll_left"] = ["head_center"] + [
+    f"head_move {-x_offset} {y_offset} {servo_delay}"
+    for x_offset, y_offset, servo_delay in head_macros["head_roll"][1:-1]
+] + ["head_center"]
+
+# 表情结束后眼睛不是默认形状, 眨眼会把眼睛画回默认形状
+eye_expressions = {"eye_happy", "eye_sad", "eye_anger", "eye_surprise"}
+firmware_commands = set(name for _, name in eye_button_list) | set(head_macros) | {"head_move"} | set(animations_list)
+
+
+def expand_actions(actions):
+    """Translate an LLM actions list into firmware command lines."""
+    commands = []
+    for action in actions:
+        action = action.strip()
+        if action:
+            expanded = action_commands.get(action, action)
+            commands.extend(expanded) if isinstance(expanded, list) else commands.append(expanded)
+    return commands
+
+
+def clamp(value, low, high):
+    return max(low, min(high, value))
+
+
+def move_to(position, x_offset, y_offset):
+    """Servo angles after head_move(x_offset, y_offset), clamped like the firmware does."""
+    return (clamp(position[0] + x_offset, X_CENTER - X_OFFSET, X_CENTER + X_OFFSET),
+            clamp(position[1] + y_offset, Y_CENTER - Y_OFFSET, Y_CENTER + Y_OFFSET))
+
+
+def parse_move(command):
+    """Return (x_offset, y_offset, servo_delay) of a head_move line, or None."""
+    name, *params = command.split()
+    if name != "head_move" or len(params) != 3:
+        return None
+    try:
+        return tuple(int(param) for param in params)
+    except ValueError:
+        return None
+
+
+def simulate_head(command, position):
+    """Play a firmware command on a simulated head, returns (position, motion_ms).
+    An unknown start position is estimated as the center."""
+    move = parse_move(command)
+    steps = [move] if move else head_macros.get(command.split()[0], [])
+    position = position or CENTER
+    motion_ms = 0
+    for step in steps:
+        if step == "center":
+            step = (X_CENTER - position[0], Y_CENTER - position[1], SERVO_DELAY)
+        x_offset, y_offset, servo_delay = step
+        target = move_to(position, x_offset, y_offset)
+        motion_ms += max(abs(target[0] - position[0]), abs(target[1] - position[1])) // STEP * servo_delay
+        position = target
+    return position, motion_ms
+
+
+def motion_time(commands, position=None):
+    """Estimated servo sweep time of firmware commands in milliseconds."""
+    total = 0
+    for command in commands:
+        position, motion_ms = simulate_head(command, position)
+        total += motion_ms
+    return total
+
+
+def _same_direction(a, b):
+    return a * b >= 0
+
+
+class ActionCompiler(object):
+    """Compile an LLM actions list into the fewest firmware commands with the same visible
+    result: unknown names are dropped, consecutive head_move lines that keep their direction
+    on both axes are merged into one sweep and clamped to the servo limits, and head_center /
+    eye_blink are dropped where the head or the eyes are already there. The head position
+    and eye state are carried over to the next actions list."""
+
+    def __init__(self, position=None):
+        self.position = position  # 舵机角度 (x, y), None 表示未知
+        self.eyes_neutral = False
+        self.last_report = {}
+
+    def reset(self, position=None):
+        self.position = position
+        self.eyes_neutral = False
+
+    def compile(self, actions):
+        original = expand_actions(actions)
+        start_position = self.position
+        start_neutral = self.eyes_neutral
+        commands = []
+        unknown = []
+        pending = None  # 待合并的 [x_offset, y_offset, servo_delay]
+
+        def flush():
+            nonlocal pending
+            if pending is None:
+                return
+            x_offset, y_offset, servo_delay = pending
+            pending = None
+            if self.position is not None:
+                target = move_to(self.position, x_offset, y_offset)
+                x_offset, y_offset = target[0] - self.position[0], target[1] - self.position[1]
+                self.position = target
+            else:
+                # 位置未知时偏移量最多为整个活动范围, 超出部分固件也会截掉
+                x_offset = clamp(x_offset, -2 * X_OFFSET, 2 * X_OFFSET)
+                y_offset = clamp(y_offset, -2 * Y_OFFSET, 2 * Y_OFFSET)
+            if x_offset or y_offset:
+                commands.append(f"head_move {x_offset} {y_offset} {servo_delay}")
+
+        for command in original:
+            name = command.split()[0]
+            move = parse_move(command)
+            if name not in firmware_commands and name not in host_delays or name == "head_move" and move is None:
+                unknown.append(command)
+                continue
+            if move is not None:
+                if pending and pending[2] == move[2] and _same_direction(pending[0], move[0]) \
+                        and _same_direction(pending[1], move[1]):
+                    pending[0] += move[0]
+                    pending[1] += move[1]
+                else:
+                    flush()
+                    pending = list(move)
+                continue
+            flush()
+            if name == "head_center" and self.position == CENTER:
+                continue
+            if name == "eye_blink" and commands and commands[-1] == "eye_blink":
+                continue
+            commands.append(command)
+            if name in head_macros:
+                end_position, _ = simulate_head(command, self.position)
+                # head_center / head_roll 结束时回到中心, 点头摇头在位置已知时才能推算
+                self.position = end_position if self.position is not None or name in ("head_center", "head_roll") else None
+            if name.startswith("eye_") or name in animations_list:
+                self.eyes_neutral = name not in eye_expressions and name not in animations_list
+        flush()
+
+        # 末尾的眨眼只在眼睛已经是默认形状时才多余, 单独的眨眼命令保留
+        if len(commands) > 1 and commands[-1] == "eye_blink" and self._neutral_before(commands[:-1], start_neutral):
+            commands.pop()
+
+        self.last_report = {
+            "original": len(original),
+            "commands": len(commands),
+            "removed": len(original) - len(commands),
+            "unknown": unknown,
+            "motion_saved_ms": motion_time(original, start_position) - motion_time(commands, start_position),
+        }
+        if self.last_report["removed"]:
+            logger.info("Compiled {original} commands into {commands}, saved {motion_saved_ms} ms of servo motion".format(
+                **self.last_report))
+        if unknown:
+            logger.warning(f"Dropped unknown actions: {unknown}")
+        return commands
+
+    @staticmethod
+    def _neutral_before(commands, start_neutral):
+        for command in reversed(commands):
+            name = command.split()[0]
+            if name.startswith("eye_") or name in animations_list:
+                return name not in eye_expressions and name not in animations_list
+        return start_neutral
+
+
+# 固件执行时间的组成 (毫秒): SSD1306 每刷新一帧约 25 ms (400 kHz I2C 传输 1 KB),
+# loop() 每条命令后 delay(10), 表情函数末尾 delay(100), move_eye 中间 delay(1000) 加 12 次 delay(1)
+# 动画在固件里没有实现, 会立刻回复 'Unknown command: <cmd>', 只算 loop 和传输时间
+FRAME_MS = 25
+LOOP_MS = 10
+eye_frames = {
+    "eye_blink": 7,
+    "eye_happy": 11,
+    "eye_sad": 11,
+    "eye_anger": 11,
+    "eye_surprise": 15,
+    "eye_left": 13,
+    "eye_right": 13,
+}
+eye_delays = {
+    "eye_happy": 100,
+    "eye_sad": 100,
+    "eye_anger": 100,
+    "eye_surprise": 100,
+    "eye_left": 1012,
+    "eye_right": 1012,
+}
+
+
+class TimingModel(object):
+    """Predict how long the firmware takes to run each command, from the frame counts,
+    delays and servo steps in board.ino. Per-command scale factors are calibrated from the
+    measured service time between acks (exponential moving average)."""
+
+    def __init__(self, frame_ms=FRAME_MS, baudrate=115200, alpha=0.3):
+        self.frame_ms = frame_ms
+        self.baudrate = baudrate
+        self.alpha = alpha
+        self.scales = {}  # 命令名 -> 实测时间 / 模型时间
+
+    def base_ms(self, command, position=None):
+        """Model time of one command before calibration, returns (ms, position)."""
+        name = command.split()[0]
+        if name in host_delays:
+            return host_delays[name] * 1000, position
+        # 10 bits per byte including the newline
+        transfer_ms = (len(command) + 1) * 10 * 1000 / self.baudrate
+        ms = LOOP_MS + transfer_ms
+        if name in eye_frames:
+            ms += eye_frames[name] * self.frame_ms + eye_delays.get(name, 0)
+        elif name in head_macros or name == "head_move":
+            position, motion_ms = simulate_head(command, position)
+            ms += motion_ms
+        return ms, position
+
+    def predict_ms(self, command, position=None):
+        """Calibrated time of one command, returns (ms, position)."""
+        ms, position = self.base_ms(command, position)
+        return ms * self.scales.get(command.split()[0], 1.0), position
+
+    def predict(self, commands, position=None):
+        """Per-command predicted times in milliseconds."""
+        times = []
+        for command in commands:
+            ms, position = self.predict_ms(command, position)
+            times.append(ms)
+        return times
+
+    def duration(self, commands, position=None):
+        """Predicted time of a whole command list in seconds."""
+        return sum(self.predict(commands, position)) / 1000
+
+    def check_budget(self, commands, budget, position=None):
+        """Predicted duration in seconds, warns when it is over budget."""
+        duration = self.duration(commands, position)
+        if budget is not None and duration > budget:
+            logger.warning(f"Action sequence takes about {duration:.1f} s, over the {budget:.1f} s budget: {commands}")
+        return duration
+
+    def observe(self, command, base_ms, measured_ms):
+        name = command.split()[0]
+        if name in host_delays or base_ms <= 0 or measured_ms <= 0:
+            return
+        ratio = min(max(measured_ms / base_ms, 0.25), 4.0)
+        scale = self.scales.get(name)
+        self.scales[name] = ratio if scale is None else scale + self.alpha * (ratio - scale)
+
+    def calibrate(self, results):
+        """Update the scale factors from ActionPipeline results. The service time of a command
+        runs from its send (or the previous ack, if that came later) to its own ack."""
+        previous_ack = 0
+        for r in results:
+            if r.get("acked_at") is None:
+                previous_ack = 0
+                continue
+            if r.get("base_ms") is not None:
+                self.observe(r["command"], r["base_ms"], (r["acked_at"] - max(r["sent_at"], previous_ack)) * 1000)
+            previous_ack = r["acked_at"]
+
+
+class SendScheduler(object):
+    """Flow control of one command list, shared by ActionPipeline (threads) and
+    DeviceManager (asyncio). steps() yields what the caller should do next:
+
+        ("ack", None)       pop pending[0] and wait for its ack until its deadline
+        ("sleep", seconds)  host delay, all earlier commands are acked
+        ("idle", seconds)   wait at most this long for the ack of pending[-1]
+        ("send", command)   send it now, then report the ack future with sent()
+
+    At most window commands are in flight. With a timing model the next command is sent
+    lead seconds before the device is predicted to be idle, and an ack may take
+    ack_timeout seconds past the predicted finish of its command."""
+
+    def __init__(self, window=2, ack_timeout=5.0, timing=None, lead=0.05, position=None):
+        self.window = window
+        self.ack_timeout = ack_timeout
+        self.timing = timing
+        self.lead = lead
+        self.position = position
+        self.pending = deque()  # (command, sent_at, future, deadline, base_ms)
+        self.busy_until = time.time()  # 预计设备空闲的时刻
+
+    def steps(self, commands):
+        for command in commands:
+            if command in host_delays:
+                while self.pending:
+                    yield "ack", None
+                yield "sleep", host_delays[command]
+                continue
+            while len(self.pending) >= self.window:
+                yield "ack", None
+            if self.timing and self.pending:
+                # 在设备预计空闲前 lead 秒再发送, 前一条提前确认时立即发送
+                yield "idle", max(self.busy_until - self.lead - time.time(), 0)
+                if self.pending[-1][2].done():
+                    self.busy_until = time.time()
+            yield "send", command
+        while self.pending:
+            yield "ack", None
+
+    def sent(self, command, future, sent_at):
+        base_ms = None
+        deadline = sent_at + self.ack_timeout
+        if self.timing:
+            base_ms, self.position = self.timing.base_ms(command, self.position)
+            self.busy_until = max(self.busy_until, sent_at) + \
+                base_ms * self.timing.scales.get(command.split()[0], 1.0) / 1000
+            deadline = self.busy_until + self.ack_timeout
+        self.pending.append((command, sent_at, future, deadline, base_ms))
+
+    @staticmethod
+    def result(entry, reply=None, received_at=None):
+        """Result of a pending entry, a failure when received_at is None."""
+        command, sent_at, _, _, base_ms = entry
+        return {"command": command, "ok": received_at is not None and reply_ok(reply),
+                "latency": received_at - sent_at if received_at is not None else None,
+                "sent_at": sent_at, "acked_at": received_at, "base_ms": base_ms}
+
+    def calibrate(self, results):
+        if self.timing:
+            self.timing.calibrate(results)
+
+
+class ActionPipeline(object):
+    """Send firmware commands with a small in-flight window, using the firmware's echo of
+    each command (or its ACK frame in binary mode) as the acknowledgement. With a timing
+    model the next command is sent just before the device is predicted to be idle, ack
+    timeouts count from the predicted finish, and the model is calibrated from the acks.
+    on_result, when given, is called with each command's result as soon as it is acked."""
+
+    def __init__(self, client, window=2, ack_timeout=5.0, timing=None, lead=0.05, position=None, budget=None,
+                 on_result=None):
+        self.client = client
+        self.window = window
+        self.ack_timeout = ack_timeout
+        self.timing = timing
+        self.lead = lead
+        self.position = position
+        self.budget = budget
+        self.on_result = on_result
+        self.last_report = {}
+
+    def _wait_ack(self, entry, results):
+        command, sent_at, future, deadline, _ = entry
+        try:
+            reply, received_at = future.result(timeout=max(deadline - time.time(), 0))
+            results.append(SendScheduler.result(entry, reply, received_at))
+            metrics.observe("command_seconds", received_at - sent_at, transport="serial")
+            metrics.inc("commands_total", status="ok" if results[-1]["ok"] else "rejected")
+        except FutureTimeoutError:
+            self.client.cancel(future)
+            metrics.inc("commands_total", status="timeout")
+            metrics.inc("ack_timeouts_total")
+            results.append(SendScheduler.result(entry))
+            logger.warning(f"No ack for '{command}' after {deadline - sent_at:.1f} s")
+        except Exception as e:
+            # 串口断开时未确认的命令都以异常结束
+            metrics.inc("commands_total", status="error")
+            results.append(SendScheduler.result(entry))
+            logger.warning(f"'{command}' failed: {e}")
+        if self.on_result:
+            self.on_result(results[-1])
+
+    def run(self, actions):
+        """Play an actions list back-to-back, returns per-command results."""
+        start_time = time.time()
+        commands = expand_actions(actions)
+        predicted = None
+        if self.timing:
+            predicted = self.timing.check_budget(commands, self.budget, self.position)
+        scheduler = SendScheduler(self.window, self.ack_timeout, self.timing, self.lead, self.position)
+        results = []
+        for step, arg in scheduler.steps(commands):
+            if step == "ack":
+                self._wait_ack(scheduler.pending.popleft(), results)
+            elif step == "sleep":
+                time.sleep(arg)
+            elif step == "idle":
+                wait([scheduler.pending[-1][2]], timeout=arg)
+            else:
+                sent_at = time.time()
+                scheduler.sent(arg, self.client.send_command(arg), sent_at)
+        self.position = scheduler.position
+        scheduler.calibrate(results)
+
+        latencies = [r["latency"] for r in results if r["latency"] is not None]
+        self.last_report = {
+            "commands": len(results),
+            "failed": sum(1 for r in results if not r["ok"]),
+            "total": time.time() - start_time,
+            "predicted": predicted,
+            "avg_latency": sum(latencies) / len(latencies) if latencies else None,
+            "max_latency": max(latencies) if latencies else None,
+            "results": results,
+        }
+        logger.info("Played {commands} commands in {total:.2f} s, {failed} failed".format(**self.last_report))
+        if predicted is not None:
+            logger.info(f"Predicted {predicted:.2f} s, calibration: {self.timing.scales}")
+        for r in results:
+            latency = f"{r['latency'] * 1000:.0f} ms" if r["latency"] is not None else "timeout"
+            logger.debug(f"  {r['command']}: {latency}")
+        return results
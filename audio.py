@@ -1,39 +1,119 @@
+import io
+import re
 import time
-import pygame
-import speech_recognition as sr
 from concurrent.futures import ThreadPoolExecutor
 
 from common import *
+from metrics import metrics
+
+
+# 上传格式: 名称 -> (扩展名, 采样率), 采样率为 None 时保持录音原始采样率
+# 语音识别只需要 16 kHz, 降采样后再用 FLAC 无损压缩, 上传体积最小
+upload_formats = {
+    "wav": ("wav", None),
+    "flac": ("flac", None),
+    "wav16k": ("wav", 16000),
+    "flac16k": ("flac", 16000),
+}
+
+
+def encode_audio(audio_data, audio_format="flac16k"):
+    """Encode a speech_recognition AudioData for upload, returns (bytes, filename).
+    Falls back to WAV when no FLAC encoder is available."""
+    extension, sample_rate = upload_formats[audio_format]
+    if extension == "flac":
+        try:
+            return audio_data.get_flac_data(convert_rate=sample_rate, convert_width=2), "input.flac"
+        except Exception as e:
+            logger.warning(f"FLAC encoding failed, uploading WAV instead: {e}")
+    return audio_data.get_wav_data(convert_rate=sample_rate, convert_width=2), "input.wav"
 
 
 class Listener(object):
 
-    def __init__(self, gpt=None):
-        self.recognizer = sr.Recognizer()
+    def __init__(self, gpt=None, audio_format="flac16k"):
+        self.recognizer = None
         self.executor = ThreadPoolExecutor(max_workers=1)
         self.gpt = gpt
+        self.audio_format = audio_format
 
-    def hear(self, audio_path="input.wav", timeout=8):
+    def hear(self, timeout=8):
         try:
+            # speech_recognition 和 PyAudio 在第一次录音时才导入
+            import speech_recognition as sr
+            if self.recognizer is None:
+                self.recognizer = sr.Recognizer()
             with sr.Microphone() as source:
                 print("开始说话...")
-                audio_data = self.recognizer.listen(source, timeout=timeout)
+                with metrics.span("record"):
+                    audio_data = self.recognizer.listen(source, timeout=timeout)
                 print("录音已完成")
-                with open(audio_path, "wb") as audio_file:
-                    audio_file.write(audio_data.get_wav_data())
-                return self.gpt.speech(audio_path=audio_path)
+            # 录音直接在内存中编码上传, 不写临时文件
+            audio_bytes, filename = encode_audio(audio_data, self.audio_format)
+            metrics.inc("bytes_sent_total", len(audio_bytes), transport="asr")
+            with metrics.span("asr"):
+                return self.gpt.speech(audio_bytes=audio_bytes, filename=filename)
 
         except Exception as e:
             error(e, "Speech recognition Failed")
 
 
+_sentence_end = re.compile(r'(?<=[。！？；…\n])|(?<=[.!?;])(?=\s)')
+_clause_end = re.compile(r'(?<=[，,、：:])')
+
+
+def split_sentences(text, max_chars=40, first_chars=12):
+    """Split text into sentences for pipelined synthesis. The first chunk is cut at the
+    first clause once it is long enough, so that playback can start as early as possible."""
+    chunks = []
+    for sentence in _sentence_end.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        limit = first_chars if not chunks else max_chars
+        if len(sentence) <= limit:
+            chunks.append(sentence)
+            continue
+        # 过长的句子在分句处再切开
+        current = ""
+        for clause in _clause_end.split(sentence):
+            if current and len(current) + len(clause) > limit:
+                chunks.append(current)
+                current = ""
+                limit = max_chars
+            current += clause
+        if current:
+            chunks.append(current)
+    return chunks
+
+
+# 常用的固定回复, 可以用 warm_up 提前合成并缓存
+stock_phrases = [
+    "好的主人",
+    "你好呀",
+    "今天真开心",
+    "哇哦",
+    "API返回了空响应，请检查模型配置或重试。",
+    "OpenAI 连接失败！请检查 API 配置",
+]
+
+
 class Speaker(object):
-    def __init__(self, gpt=None):
+    def __init__(self, gpt=None, synth_workers=3):
         self.executor = ThreadPoolExecutor(max_workers=1)
-        pygame.mixer.init()
+        self.synth_executor = ThreadPoolExecutor(max_workers=synth_workers)
         self.gpt = gpt
+        self.last_timings = {}
+
+    def _init_mixer(self):
+        # pygame 在第一次播放时才导入并初始化混音器
+        import pygame
+        if not pygame.mixer.get_init():
+            pygame.mixer.init()
+        return pygame
 
     def _play_audio(self, audio_path):
+        pygame = self._init_mixer()
         pygame.mixer.music.load(audio_path)
         pygame.mixer.music.play()
         while pygame.mixer.music.get_busy():
@@ -47,12 +127,91 @@ class Speaker(object):
         except Exception as e:
             error(e, "Speak Failed")
 
+    def warm_up(self, phrases=None, voice="onyx"):
+        """Pre-render phrases (and their sentence chunks) into the audio cache."""
+        rendered = 0
+        for phrase in phrases or stock_phrases:
+            for text in dict.fromkeys([phrase] + split_sentences(phrase)):
+                if self.gpt.synthesize(text=text, voice=voice):
+                    rendered += 1
+        logger.info(f"Pre-rendered {rendered} clips, audio cache: {self.gpt.audio_cache.stats}")
+        return rendered
+
+    def say_stream(self, text="", voice="onyx", on_start=None):
+        """Synthesize text sentence by sentence in parallel and start playing the first
+        sentence while the rest are still being fetched. Audio never touches the disk.
+        on_start is called right before the first sentence starts playing."""
+        chunks = split_sentences(text)
+        if not chunks:
+            return None
+        start_time = time.time()
+        timings = {"chunks": len(chunks), "synth": [], "audio": 0.0}
+        futures = [self.synth_executor.submit(self._synthesize_chunk, chunk, voice, start_time, timings)
+                   for chunk in chunks]
+        return self.executor.submit(self._play_stream, futures, start_time, timings, on_start)
+
+    def _synthesize_chunk(self, chunk, voice, start_time, timings):
+        synth_start = time.time()
+        audio = self.gpt.synthesize(text=chunk, voice=voice)
+        timings["synth"].append(time.time() - synth_start)
+        logger.debug(f"Synthesized '{chunk}' at {(time.time() - start_time) * 1000:.0f} ms")
+        return audio
+
+    def _play_stream(self, futures, start_time, timings, on_start=None):
+        try:
+            pygame = self._init_mixer()
+            channel = None
+            for future in futures:
+                audio = future.result()
+                if not audio:
+                    continue
+                sound = pygame.mixer.Sound(io.BytesIO(audio))
+                timings["audio"] += sound.get_length()
+                if channel is None:
+                    # 所有声道都被占用时 Sound.play() 返回 None, 等到有空闲声道再开始播放
+                    channel = pygame.mixer.find_channel()
+                    while channel is None:
+                        time.sleep(0.01)
+                        channel = pygame.mixer.find_channel()
+                    if on_start:
+                        on_start()
+                    channel.play(sound)
+                    timings["first_audio"] = time.time() - start_time
+                    logger.info(f"Time to first audio: {timings['first_audio'] * 1000:.0f} ms")
+                    continue
+                # 每个声道只能排队一个片段, 等上一个开始播放后再排下一个, 片段之间无缝衔接
+                while channel.get_queue() is not None:
+                    time.sleep(0.01)
+                channel.queue(sound)
+            while channel is not None and channel.get_busy():
+                time.sleep(0.05)
+            timings["total"] = time.time() - start_time
+        except Exception as e:
+            error(e, "Speak Failed")
+        self.last_timings = timings
+        return timings
+
 
 if __name__ == "__main__":
+    import argparse
     from gpt import *
+
+    parser = argparse.ArgumentParser(description="Speech test and TTS cache warm-up")
+    parser.add_argument("--warm", nargs="?", const="", default=None, metavar="PHRASE_FILE",
+                        help="pre-render the stock phrases, or one phrase per line of PHRASE_FILE, into the cache")
+    parser.add_argument("--voice", default="onyx")
+    args = parser.parse_args()
+
     llm = GPT()
     llm.connect()
     # listener = Listener(llm)
     # print(listener.hear())
     speaker = Speaker(llm)
-    speaker.say(text="你好呀")
+    if args.warm is not None:
+        phrases = None
+        if args.warm:
+            with open(args.warm, 'r', encoding='utf-8') as fp:
+                phrases = [line.strip() for line in fp if line.strip()]
+        speaker.warm_up(phrases, voice=args.voice)
+    else:
+        speaker.say(text="你好呀", voice=args.voice)
@@ -0,0 +1,681 @@
+import argparse
+import asyncio
+import base64
+import time
+
+from common import *
+
+
+def percentiles(values):
+    """p50/p95/p99/max of a list of seconds, reported in milliseconds."""
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+
+    def pick(q):
+        return round(values[min(int(q * len(values)), len(values) - 1)] * 1000, 3)
+
+    return {"count": len(values), "p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99),
+            "max": round(values[-1] * 1000, 3)}
+
+
+def print_report(report):
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+def bench_ble(args):
+    from connect import BaseBluetoothClient, FakeBleBackend
+
+    commands = ["eye_happy", "head_move -45 0 10", "head_center", "head_nod", "head_center", "eye_blink"]
+    commands = (commands * (args.commands // len(commands) + 1))[:args.commands]
+
+    async def run(mode):
+        backend = lambda address: FakeBleBackend(address, mtu=args.mtu, interval=args.interval)
+        client = BaseBluetoothClient("Desk-Emoji", characteristic_uuid="cmd", notify_uuid="cmd", backend=backend)
+        client.use_binary = args.binary
+        await client.connect("fake")
+        start_time = time.perf_counter()
+        if mode == "legacy":
+            # 原有方式: 每条命令一次带响应写入, 并等待写入完成
+            latencies = []
+            for command in commands:
+                sent_at = time.perf_counter()
+                await client.send(command)
+                latencies.append(time.perf_counter() - sent_at)
+            writes = client.client.writes
+        else:
+            results = await client.send_commands(commands)
+            latencies = [r["latency"] for r in results if r["latency"] is not None]
+            writes = client.send_queue.writes
+        elapsed = time.perf_counter() - start_time
+        await client.disconnect()
+        return {"commands": len(commands), "writes": writes, "seconds": round(elapsed, 4),
+                "commands_per_second": round(len(commands) / elapsed, 1), "latency_ms": percentiles(latencies)}
+
+    logger.setLevel(logging.WARNING)
+    print_report({"mtu": args.mtu, "interval_ms": args.interval * 1000, "binary": args.binary,
+                  "legacy": asyncio.run(run("legacy")), "queued": asyncio.run(run("queued"))})
+
+
+def bench_logging(args):
+    import tempfile
+
+    # 一轮对话在热路径上的日志调用, 原始响应按实际大小构造
+    raw_response = {"id": "chatcmpl", "object": "chat.completion", "model": "Qwen/QwQ-32B",
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": "x" * args.response_bytes}}],
+                    "usage": {"prompt_tokens": 811, "completion_tokens": 120, "total_tokens": 931}}
+
+    def turn(log):
+        log.info("You: %s", "点头")
+        log.info("Sending request to https://api.siliconflow.cn/v1/chat/completions with model Qwen/QwQ-32B")
+        log.debug("Raw API response: %s", raw_response)
+        log.debug("HTTP session stats: %s", {"requests": 10, "new_connections": 1})
+        log.info("Bot: %s", raw_response["choices"][0]["message"]["content"][:200])
+
+    def run(mode, directory):
+        log = logging.getLogger(f"bench-{mode}")
+        log.setLevel(logging.DEBUG)
+        log.propagate = False
+        handlers = create_log_handlers(directory)
+        handlers[-1].setStream(open(os.devnull, 'w'))
+        listener = None
+        if mode == "sync":
+            # 原有方式: 调用线程直接写 3 个文件和终端
+            for handler in handlers:
+                log.addHandler(handler)
+        else:
+            listener = setup_logger(log, handlers)
+        latencies = []
+        start_time = time.perf_counter()
+        for _ in range(args.turns):
+            turn_start = time.perf_counter()
+            turn(log)
+            latencies.append(time.perf_counter() - turn_start)
+        caller_seconds = time.perf_counter() - start_time
+        if listener:
+            listener.stop()
+            atexit.unregister(listener.stop)
+        total_seconds = time.perf_counter() - start_time
+        for handler in handlers:
+            handler.close()
+        return {"turns": args.turns, "per_turn_ms": percentiles(latencies),
+                "caller_seconds": round(caller_seconds, 4), "total_seconds_including_drain": round(total_seconds, 4)}
+
+    with tempfile.TemporaryDirectory() as sync_dir, tempfile.TemporaryDirectory() as queued_dir:
+        print_report({"response_bytes": args.response_bytes, "sync": run("sync", sync_dir),
+                      "queued": run("queued", queued_dir)})
+
+
+def bench_speech(args):
+    import math
+    import random
+    import speech_recognition as sr
+    from audio import encode_audio, upload_formats
+
+    if args.wav:
+        with sr.AudioFile(args.wav) as source:
+            audio_data = sr.Recognizer().record(source)
+    else:
+        # 没有录音文件时生成一段带噪声的 44.1 kHz 合成语音替代
+        rate = 44100
+        frames = bytearray()
+        for i in range(int(rate * args.seconds)):
+            sample = 6000 * math.sin(2 * math.pi * 220 * i / rate) * (0.5 + 0.5 * math.sin(2 * math.pi * 3 * i / rate))
+            sample += random.gauss(0, 300)
+            frames += int(max(-32768, min(32767, sample))).to_bytes(2, 'little', signed=True)
+        audio_data = sr.AudioData(bytes(frames), rate, 2)
+
+    llm = None
+    if args.transcribe:
+        from gpt import GPT
+        llm = GPT()
+        llm.connect()
+
+    report = {"seconds": round(len(audio_data.frame_data) / audio_data.sample_rate / audio_data.sample_width, 2),
+              "formats": {}}
+    for audio_format in upload_formats:
+        start_time = time.perf_counter()
+        audio_bytes, filename = encode_audio(audio_data, audio_format)
+        result = {"filename": filename, "bytes": len(audio_bytes),
+                  "encode_ms": round((time.perf_counter() - start_time) * 1000, 1)}
+        if llm:
+            latencies = []
+            for _ in range(args.repeat):
+                start_time = time.perf_counter()
+                llm.speech(audio_bytes=audio_bytes, filename=filename)
+                latencies.append(time.perf_counter() - start_time)
+            result["transcribe_ms"] = percentiles(latencies)
+        report["formats"][audio_format] = result
+    print_report(report)
+
+
+def start_emulator(time_scale=0.0, text_only=False, boot=False):
+    """Run emulator.py in a child process, so that its CPU time is not counted as ours.
+    Returns (process, port)."""
+    import subprocess
+    import sys
+
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "emulator.py"),
+               "--time-scale", str(time_scale)]
+    if text_only:
+        command.append("--text-only")
+    if boot:
+        command.append("--boot")
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    return process, process.stdout.readline().strip()
+
+
+def bench_serial(args):
+    from connect import SerialClient
+    from action import ActionPipeline
+
+    commands = ["eye_happy", "head_move -45 0 10", "head_center", "head_nod", "head_center", "eye_blink"]
+    commands = (commands * (args.commands // len(commands) + 1))[:args.commands]
+    logger.setLevel(logging.WARNING)
+    report = {"time_scale": args.time_scale, "firmware": "text" if args.text_only else "binary", "boot": args.boot,
+              "runs": {}}
+    process = None
+    try:
+        for protocol in ("binary", "text"):
+            # 每种协议重新启动模拟器, 和真实开发板一样打开串口后先走一遍 setup()
+            if process is None or args.boot:
+                if process is not None:
+                    process.terminate()
+                    process.wait()
+                process, port = start_emulator(args.time_scale, args.text_only, args.boot)
+            client = SerialClient()
+            client.use_binary = protocol == "binary"
+            start_time = time.perf_counter()
+            client.connect(port)
+            if client.use_binary and args.boot:
+                # 复位期间协商不到, 等欢迎语之后的重新协商
+                while not client.protocol_version and time.perf_counter() - start_time < 10:
+                    time.sleep(0.05)
+                report["binary_after_s"] = round(time.perf_counter() - start_time, 2)
+            if client.use_binary and not client.protocol_version:
+                client.disconnect()
+                continue
+
+            # 空闲时读线程阻塞在 read 上, 不应占用 CPU
+            cpu_start = time.process_time()
+            time.sleep(args.idle)
+            idle_cpu = (time.process_time() - cpu_start) / args.idle
+
+            for window in args.windows:
+                pipeline = ActionPipeline(client, window=window)
+                cpu_start = time.process_time()
+                start_time = time.perf_counter()
+                results = pipeline.run(commands)
+                elapsed = time.perf_counter() - start_time
+                cpu = time.process_time() - cpu_start
+                report["runs"][f"{protocol}/window={window}"] = {
+                    "commands": len(results),
+                    "failed": pipeline.last_report["failed"],
+                    "commands_per_second": round(len(results) / elapsed, 1),
+                    "ack_latency_ms": percentiles([r["latency"] for r in results if r["latency"] is not None]),
+                    "cpu_percent": round(cpu / elapsed * 100, 1),
+                    "cpu_ms_per_command": round(cpu / len(results) * 1000, 3),
+                    "idle_cpu_percent": round(idle_cpu * 100, 2),
+                }
+            client.disconnect()
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+    print_report(report)
+
+
+def git_revision():
+    import subprocess
+
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__)), text=True).strip()
+    except Exception:
+        return ""
+
+
+def bench_e2e(args):
+    """Voice turns against the mock server through the same path as a real turn: ASR, chat,
+    parse, then TurnOrchestrator.run, which streams the speech through Speaker.say_stream
+    and dispatches the compiled actions to the emulated firmware side by side."""
+    # 没有声卡的机器上用 SDL 的空设备播放, 播放时长与真实设备相同
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    from action import ActionCompiler, ActionPipeline, TimingModel
+    from audio import Speaker
+    from connect import SerialClient
+    from gpt import GPT, parse_response
+    from mock_server import MockProvider, MockServer, silence_wav
+    from turn import TurnOrchestrator
+
+    logger.setLevel(logging.WARNING)
+    provider = MockProvider(latency=args.latency, jitter=args.jitter, token_rate=args.token_rate,
+                            stream=args.stream, error_rate=args.error_rate, tts_latency=args.tts_latency,
+                            asr_latency=args.asr_latency, seed=0)
+    server = MockServer(provider)
+    server.start()
+    process, port = start_emulator(args.time_scale)
+    client = SerialClient()
+    client.connect(port)
+
+    llm = GPT(warm_up=False)
+    # 走 HTTP 接口的服务商分支, 语音合成和识别使用同一个连接池
+    llm.provider = "deepseek"
+    llm.api_url = server.chat_url
+    llm.api_key = "mock"
+    llm.session.warm_up(server.chat_url, background=False)
+    if not args.cache:
+        llm.intents = None
+        llm.audio_cache.enabled = False
+    compiler = ActionCompiler()
+    timing = TimingModel()
+    audio_bytes = silence_wav(3.0)
+
+    stages = {name: [] for name in ("asr", "llm", "first_action", "parse", "compile", "dispatch", "first_audio",
+                                    "synth", "playback", "speech_and_motion", "turn")}
+    # 旧固件不认识动画名, 这些命令会被拒绝
+    failures = {"llm_without_actions": 0, "tts": 0, "rejected_commands": 0}
+    overlap = []  # 顺序执行合成、播放和动作的时间 / 实际时间
+
+    def dispatch(actions):
+        start_time = time.perf_counter()
+        position = compiler.position
+        commands = compiler.compile(actions)
+        stages["compile"].append(time.perf_counter() - start_time)
+        pipeline = ActionPipeline(client, timing=timing, position=position)
+        pipeline.run(commands)
+        failures["rejected_commands"] += pipeline.last_report["failed"]
+
+    speaker = Speaker(llm)
+    turns = TurnOrchestrator(speaker, dispatch)
+    try:
+        for turn in range(args.turns):
+            turn_start = time.perf_counter()
+
+            start_time = time.perf_counter()
+            question = llm.speech(audio_bytes=audio_bytes, filename="input.wav")
+            stages["asr"].append(time.perf_counter() - start_time)
+            question = f"{question or '给我讲个笑话'} {turn}"
+
+            start_time = time.perf_counter()
+            if args.stream:
+                first_action = []
+                response = llm.chat_stream(question, use_cache=args.cache, on_action=lambda action: first_action.append(
+                    time.perf_counter()) if not first_action else None)
+                if first_action:
+                    stages["first_action"].append(first_action[0] - start_time)
+            else:
+                response = llm.chat(question, use_cache=args.cache)
+            stages["llm"].append(time.perf_counter() - start_time)
+
+            start_time = time.perf_counter()
+            answer, actions = parse_response(response)
+            stages["parse"].append(time.perf_counter() - start_time)
+            if not actions:
+                failures["llm_without_actions"] += 1
+
+            report = turns.run(answer, actions, speak=True)
+            stages["speech_and_motion"].append(report["wall"])
+            stages["dispatch"].append(report["dispatch"])
+            stages["synth"].append(report["synth"])
+            stages["playback"].append(report["playback"])
+            if report["first_audio"] is None:
+                failures["tts"] += 1
+            else:
+                stages["first_audio"].append(report["first_audio"])
+            if report["wall"]:
+                overlap.append(report["serial"] / report["wall"])
+
+            stages["turn"].append(time.perf_counter() - turn_start)
+    finally:
+        client.disconnect()
+        process.terminate()
+        process.wait()
+        server.stop()
+
+    report = {
+        "revision": git_revision(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {key: value for key, value in vars(args).items() if key not in ("func", "bench", "output")},
+        "stages_ms": {name: percentiles(values) for name, values in stages.items()},
+        # 大于 1 表示语音合成、播放和动作有重叠
+        "overlap": round(sum(overlap) / len(overlap), 2) if overlap else None,
+        "failures": failures,
+        "server": provider.stats,
+        "http": llm.session.stats,
+    }
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fp:
+            json.dump(report, fp, indent=2, ensure_ascii=False)
+
+
+# 语义缓存的标定数据: 同义改写应该命中, 字面相近但意思不同的不能命中
+paraphrase_pairs = [
+    ("please nod", "nod your head"), ("nod your head please", "nod your head"), ("请给我讲个笑话", "给我讲个笑话"),
+    ("请点头", "点头"), ("tell me a joke", "tell me a joke please"), ("can you tell me a joke", "tell me a joke"),
+    ("could you sing a song", "sing me a song"), ("what's the weather like today", "what is the weather today"),
+    ("讲个笑话吧", "给我讲个笑话"), ("你能给我讲个故事吗", "给我讲个故事"), ("今天天气怎么样", "今天天气如何"),
+    ("帮我设一个5分钟的计时器", "设个5分钟计时器"), ("set a timer for 5 minutes", "set a 5 minute timer"),
+    ("look to the left", "look left"), ("please look up", "look up"), ("向左看一下", "往左看"),
+    ("眨眨眼", "请眨眨眼睛"), ("show me a happy face", "make a happy face"), ("做一个开心的表情", "开心的表情"),
+    ("who are you", "who are you?"), ("你是谁", "你是谁呀"), ("what can you do", "what can you do for me"),
+    ("say hello", "say hello to me"), ("跟我打个招呼", "和我打个招呼吧"), ("recommend a movie", "recommend me a movie please"),
+    ("推荐一部电影", "给我推荐一部电影吧"), ("shake your head", "please shake your head"), ("摇摇头", "摇头"),
+    ("sing me a song", "sing a song for me"), ("讲一个关于猫的故事", "讲个关于猫的故事"),
+]
+distinct_pairs = [
+    ("set a timer for 5 minutes", "set a timer for 6 minutes"), ("what is 2+2", "what is 2+3"),
+    ("look left", "look right"), ("look up", "look down"), ("向左看", "向右看"), ("往上看", "往下看"),
+    ("nod your head", "don't nod your head"), ("点头", "不要点头"), ("点头", "摇头"), ("nod", "shake your head"),
+    ("tell me a joke", "tell me a story"), ("讲个笑话", "讲个故事"), ("今天天气怎么样", "明天天气怎么样"),
+    ("what's the weather today", "what's the weather tomorrow"), ("make a happy face", "make a sad face"),
+    ("做一个开心的表情", "做一个难过的表情"), ("sing a song", "sing a sad song"), ("recommend a movie", "recommend a game"),
+    ("推荐一部电影", "推荐一首歌"), ("who are you", "who am i"), ("你是谁", "我是谁"), ("turn on the light", "turn off the light"),
+    ("讲一个关于猫的故事", "讲一个关于狗的故事"), ("tell me about cats", "tell me about dogs"), ("打开灯", "关掉灯"),
+    ("say hello", "say goodbye"), ("眨眨眼", "眨眼三次"), ("roll left", "roll right"), ("向左转圈", "向右转圈"),
+    ("what time is it", "what day is it"),
+]
+
+
+def semantic_quality(threshold, dim=256):
+    """Share of paraphrase_pairs that hit and of distinct_pairs that (wrongly) hit, each pair
+    on its own: the first instruction is cached and the second one looked up."""
+    from cache import SemanticCache
+
+    cache = SemanticCache(capacity=4, threshold=threshold, dim=dim)
+
+    def hit(stored, query):
+        cache.clear()
+        cache.put(stored, stored, scope="bench")
+        return cache.get(query, scope="bench") is not None
+
+    hits = [pair for pair in paraphrase_pairs if hit(*pair)]
+    false_hits = [pair for pair in distinct_pairs if hit(*pair)]
+    return {
+        "paraphrase_hit_rate": round(len(hits) / len(paraphrase_pairs), 3),
+        "false_hit_rate": round(len(false_hits) / len(distinct_pairs), 3),
+        "missed": [f"{a} / {b}" for a, b in paraphrase_pairs if (a, b) not in hits],
+        "false_hits": [f"{a} / {b}" for a, b in false_hits],
+    }
+
+
+def bench_semantic(args):
+    import random
+    from cache import SemanticCache
+
+    quality = {threshold: semantic_quality(threshold, args.dim) for threshold in args.thresholds}
+    for threshold, result in quality.items():
+        if threshold != args.threshold:
+            # 只列出选定阈值下的具体样本
+            del result["missed"], result["false_hits"]
+
+    random.seed(0)
+    subjects = ["笑话", "故事", "天气", "新闻", "音乐", "电影", "游戏", "诗", "歌", "谜语", "joke", "story", "weather", "song", "poem"]
+    verbs = ["讲个", "说说", "推荐", "来一首", "聊聊", "tell me a", "sing a", "recommend a", "share a"]
+    topics = ["关于猫的", "关于太空的", "好玩的", "有趣的", "简短的", "about cats", "about space", "funny", "short", "sad"]
+
+    def instruction(i):
+        return f"{random.choice(verbs)} {random.choice(topics)} {random.choice(subjects)} {i}"
+
+    report = {}
+    for entries in args.entries:
+        cache = SemanticCache(capacity=entries, threshold=args.threshold, eviction=args.eviction, dim=args.dim)
+        stored = []
+        start_time = time.perf_counter()
+        for i in range(entries):
+            message = instruction(i)
+            stored.append(message)
+            cache.put(message, json.dumps({"answer": message, "actions": []}), scope="bench")
+        fill_time = time.perf_counter() - start_time
+
+        # 查询延迟: 一半是已存的指令, 一半是新指令 (命中率见 quality)
+        queries = [random.choice(stored) if i % 2 == 0 else instruction(entries + i) for i in range(args.lookups)]
+        embed_latencies, lookup_latencies = [], []
+        for query in queries:
+            start_time = time.perf_counter()
+            cache.embed(query)
+            embed_latencies.append(time.perf_counter() - start_time)
+            start_time = time.perf_counter()
+            cache.get(query, scope="bench")
+            lookup_latencies.append(time.perf_counter() - start_time)
+        report[entries] = {
+            "matrix_mb": round(cache.matrix.nbytes / 1024 / 1024, 1),
+            "fill_s": round(fill_time, 2),
+            "embed_ms": percentiles(embed_latencies),
+            "lookup_ms": percentiles(lookup_latencies),
+        }
+    print_report({"dim": args.dim, "threshold": args.threshold, "eviction": args.eviction,
+                  "quality": quality, "entries": report})
+
+
+def bench_fanout(args):
+    from connect import FakeBleBackend
+    from devices import DeviceManager
+
+    actions = ["eye_happy", "head_left", "head_center", "head_nod", "eye_blink"]
+    logger.setLevel(logging.WARNING)
+    manager = DeviceManager(device_timeout=args.device_timeout,
+                            backend=lambda address: FakeBleBackend(address, command_time=args.ble_command_time))
+    processes = []
+    try:
+        for i in range(args.serial):
+            # 最后一台可以设为慢设备, 检查它是否拖慢其他设备
+            slow = args.slow_scale is not None and i == args.serial - 1
+            process, port = start_emulator(args.slow_scale if slow else args.time_scale)
+            processes.append(process)
+            manager.add_serial(port, name=f"serial-{i}{'-slow' if slow else ''}", groups=["slow" if slow else "fast"])
+        for i in range(args.ble):
+            manager.add_ble(f"fake-{i}", name=f"ble-{i}", groups=["fast"])
+
+        rounds = {"all": [], "fast": []}
+        device_totals = {}
+        for _ in range(args.rounds):
+            for group in rounds:
+                reports = manager.broadcast(actions, group=None if group == "all" else group)
+                rounds[group].append(manager.last_report["total"])
+                if group == "all":
+                    for r in reports:
+                        device_totals.setdefault(r["device"], []).append(r["total"])
+        sequential = sum(sum(totals) / len(totals) for totals in device_totals.values())
+        concurrent = sum(rounds["all"]) / len(rounds["all"])
+        report = {
+            "devices": len(manager),
+            "time_scale": args.time_scale,
+            "slow_scale": args.slow_scale,
+            "broadcast_ms": {group: percentiles(totals) for group, totals in rounds.items()},
+            "device_ms": {name: percentiles(totals) for name, totals in sorted(device_totals.items())},
+            "sequential_estimate_ms": round(sequential * 1000, 1),
+            "speedup": round(sequential / concurrent, 2) if concurrent else None,
+            "stats": manager.stats,
+        }
+    finally:
+        manager.close()
+        for process in processes:
+            process.terminate()
+            process.wait()
+    print_report(report)
+
+
+async def _websocket_client(port, events, stop):
+    """Minimal WebSocket client for the load test, counts the events it receives."""
+    from daemon import read_ws_frame
+
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    key = base64.b64encode(os.urandom(16)).decode('ascii')
+    writer.write((f"GET /events HTTP/1.1\r\nHost: 127.0.0.1\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                  f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode('ascii'))
+    await reader.readuntil(b"\r\n\r\n")
+    try:
+        while not stop.is_set():
+            try:
+                _, payload = await asyncio.wait_for(read_ws_frame(reader), timeout=0.2)
+            except asyncio.TimeoutError:
+                continue
+            event = json.loads(payload)
+            events[event["type"]] = events.get(event["type"], 0) + 1
+    finally:
+        writer.close()
+
+
+def bench_daemon(args):
+    import httpx
+    from connect import SerialClient
+    from daemon import Daemon
+    from gpt import GPT
+    from mock_server import MockProvider, MockServer, default_responses
+
+    logger.setLevel(logging.WARNING)
+    # 去掉 1 秒的主机端延时, 否则所有请求都在排队等同一个机器人, 测不出 API 本身的开销
+    responses = [dict(r, actions=[a for a in r["actions"] if a != "delay"]) for r in default_responses]
+    provider = MockProvider(latency=args.latency, token_rate=args.token_rate, responses=responses, seed=0)
+    server = MockServer(provider)
+    server.start()
+    process, port = start_emulator(args.time_scale)
+    client = SerialClient()
+    client.connect(port)
+    llm = GPT(warm_up=False)
+    llm.provider = "deepseek"
+    llm.api_url = server.chat_url
+    llm.api_key = "mock"
+    daemon = Daemon(llm, ser=client, port=0, workers=args.workers)
+    daemon_port = daemon.start()
+    url = f"http://127.0.0.1:{daemon_port}"
+
+    async def run():
+        stop = asyncio.Event()
+        events = [{} for _ in range(args.listeners)]
+        listeners = [asyncio.ensure_future(_websocket_client(daemon_port, events[i], stop))
+                     for i in range(args.listeners)]
+        latencies, statuses = [], {}
+
+        async def user(http, index):
+            for request in range(args.requests):
+                start_time = time.perf_counter()
+                if request % 4 == 3:
+                    response = await http.post(f"{url}/actions", json={"actions": ["eye_blink", "head_nod"]})
+                else:
+                    # 缓存关闭, 每个请求都走到 LLM
+                    text = f"讲个笑话 {request}" if args.duplicates else f"讲个笑话 {index} {request}"
+                    response = await http.post(f"{url}/chat", json={"text": text, "cache": False})
+                latencies.append(time.perf_counter() - start_time)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        await asyncio.sleep(0.2)
+        start_time = time.perf_counter()
+        limits = httpx.Limits(max_connections=args.clients)
+        async with httpx.AsyncClient(timeout=120, limits=limits) as http:
+            await asyncio.gather(*(user(http, i) for i in range(args.clients)))
+        elapsed = time.perf_counter() - start_time
+        await asyncio.sleep(0.5)
+        stop.set()
+        await asyncio.gather(*listeners)
+        return elapsed, latencies, statuses, events
+
+    try:
+        elapsed, latencies, statuses, events = asyncio.run(run())
+        report = {
+            "clients": args.clients,
+            "listeners": args.listeners,
+            "workers": args.workers,
+            "requests": len(latencies),
+            "requests_per_second": round(len(latencies) / elapsed, 1),
+            "latency_ms": percentiles(latencies),
+            "statuses": statuses,
+            "events_per_listener": events[0] if events else {},
+            "daemon": daemon.status,
+            "provider": provider.stats,
+        }
+    finally:
+        daemon.stop()
+        client.disconnect()
+        server.stop()
+        process.terminate()
+        process.wait()
+    print_report(report)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Desk-Emoji host side benchmarks")
+    subparsers = parser.add_subparsers(dest="bench", required=True)
+
+    ble = subparsers.add_parser("ble", help="BLE send path against the fake backend")
+    ble.add_argument("--commands", type=int, default=200)
+    ble.add_argument("--mtu", type=int, default=185)
+    ble.add_argument("--interval", type=float, default=0.0075, help="BLE connection interval in seconds")
+    ble.add_argument("--binary", action="store_true", help="use binary frames instead of text lines")
+    ble.set_defaults(func=bench_ble)
+
+    log = subparsers.add_parser("logging", help="logging cost added to a chat turn, direct vs queued handlers")
+    log.add_argument("--turns", type=int, default=2000)
+    log.add_argument("--response-bytes", type=int, default=2000)
+    log.set_defaults(func=bench_logging)
+
+    speech = subparsers.add_parser("speech", help="upload size and transcription latency per audio format")
+    speech.add_argument("--wav", help="recorded WAV file, a synthetic sample is used when omitted")
+    speech.add_argument("--seconds", type=float, default=5)
+    speech.add_argument("--transcribe", action="store_true", help="also time GPT.speech against the configured API")
+    speech.add_argument("--repeat", type=int, default=5)
+    speech.set_defaults(func=bench_speech)
+
+    serial_ = subparsers.add_parser("serial", help="serial transport throughput against the firmware emulator")
+    serial_.add_argument("--commands", type=int, default=600)
+    serial_.add_argument("--windows", type=int, nargs="+", default=[1, 2, 4])
+    serial_.add_argument("--time-scale", type=float, default=0.0,
+                         help="emulated command time multiplier, 0 measures the transport alone")
+    serial_.add_argument("--text-only", action="store_true", help="emulate old firmware without binary frames")
+    serial_.add_argument("--boot", action="store_true", help="reset on connect like a real ESP32 (2.5 s setup())")
+    serial_.add_argument("--idle", type=float, default=2.0, help="seconds of idle CPU measurement")
+    serial_.set_defaults(func=bench_serial)
+
+    e2e = subparsers.add_parser("e2e", help="full chat turns against the mock provider and the firmware emulator")
+    e2e.add_argument("--turns", type=int, default=30)
+    e2e.add_argument("--stream", action="store_true", help="use GPT.chat_stream")
+    e2e.add_argument("--cache", action="store_true", help="allow intent, response and audio caches")
+    e2e.add_argument("--latency", type=float, default=0.3, help="chat time to first byte in seconds")
+    e2e.add_argument("--jitter", type=float, default=0.1)
+    e2e.add_argument("--token-rate", type=float, default=50.0)
+    e2e.add_argument("--error-rate", type=float, default=0.0)
+    e2e.add_argument("--tts-latency", type=float, default=0.2)
+    e2e.add_argument("--asr-latency", type=float, default=0.3)
+    e2e.add_argument("--time-scale", type=float, default=0.1, help="emulated firmware time multiplier")
+    e2e.add_argument("--output", help="also write the report to this JSON file")
+    e2e.set_defaults(func=bench_e2e)
+
+    semantic = subparsers.add_parser("semantic", help="semantic response cache lookup latency")
+    semantic.add_argument("--entries", type=int, nargs="+", default=[10000, 100000])
+    semantic.add_argument("--lookups", type=int, default=500)
+    semantic.add_argument("--dim", type=int, default=256)
+    semantic.add_argument("--threshold", type=float, default=0.88)
+    semantic.add_argument("--thresholds", type=float, nargs="+", default=[0.8, 0.85, 0.88, 0.9, 0.92],
+                          help="report paraphrase and false hit rates at these thresholds")
+    semantic.add_argument("--eviction", choices=["lru", "lfu", "fifo"], default="lru")
+    semantic.set_defaults(func=bench_semantic)
+
+    fanout = subparsers.add_parser("fanout", help="broadcast to many emulated serial and fake BLE devices")
+    fanout.add_argument("--serial", type=int, default=4, help="number of emulator processes")
+    fanout.add_argument("--ble", type=int, default=4, help="number of fake BLE devices")
+    fanout.add_argument("--rounds", type=int, default=10)
+    fanout.add_argument("--time-scale", type=float, default=0.1)
+    fanout.add_argument("--slow-scale", type=float, default=None, help="time scale of one extra slow serial device")
+    fanout.add_argument("--ble-command-time", type=float, default=0.05)
+    fanout.add_argument("--device-timeout", type=float, default=30.0)
+    fanout.set_defaults(func=bench_fanout)
+
+    daemon = subparsers.add_parser("daemon", help="HTTP/WebSocket API load test against the mock provider and emulator")
+    daemon.add_argument("--clients", type=int, default=20, help="concurrent HTTP clients")
+    daemon.add_argument("--requests", type=int, default=8, help="requests per client, every fourth sends raw actions")
+    daemon.add_argument("--listeners", type=int, default=20, help="WebSocket event subscribers")
+    daemon.add_argument("--workers", type=int, default=8)
+    daemon.add_argument("--duplicates", action="store_true", help="all clients send the same instructions")
+    daemon.add_argument("--latency", type=float, default=0.3)
+    daemon.add_argument("--token-rate", type=float, default=0)
+    daemon.add_argument("--time-scale", type=float, default=0.0)
+    daemon.set_defaults(func=bench_daemon)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
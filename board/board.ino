@@ -26,6 +26,16 @@ int y_max = Y_CENTER + Y_OFFSET;
 Servo servo_x;
 Servo servo_y;
 
+// Binary protocol: SYNC | LEN | OP | SEQ | ARGS | CRC8, LEN counts OP+SEQ+ARGS,
+// CRC8 (poly 0x07) covers LEN..ARGS. Opcodes must match BinaryProtocol in connect.py.
+#define PROTO_VERSION 1
+#define FRAME_SYNC 0xA5
+#define FRAME_MAX 16
+#define OP_ACK 0x80
+#define STATUS_OK 0
+#define STATUS_UNKNOWN 1
+#define STATUS_BAD_CRC 2
+
 // Adjustable
 int ref_eye_height = 40;
 int ref_eye_width = 40;
@@ -66,6 +76,7 @@ void head_nod(int servo_delay);
 void head_shake(int servo_delay);
 void head_roll(int servo_delay);
 void print_angle();
+void handle_frame();
 
 void draw_eyes(bool update = true) {
   display.clearDisplay();
@@ -415,6 +426,88 @@ void print_angle() {
   Serial.println("}");
 }
 
+// Binary opcode table, handlers read packed little-endian arguments
+typedef void (*op_handler)(const uint8_t *args);
+
+struct OpEntry {
+  uint8_t op;
+  uint8_t argc;
+  op_handler handler;
+};
+
+void op_eye_blink(const uint8_t *args) { eye_blink(); }
+void op_eye_happy(const uint8_t *args) { eye_happy(); }
+void op_eye_sad(const uint8_t *args) { eye_sad(); }
+void op_eye_anger(const uint8_t *args) { eye_anger(); }
+void op_eye_surprise(const uint8_t *args) { eye_surprise(); }
+void op_eye_right(const uint8_t *args) { eye_right(); }
+void op_eye_left(const uint8_t *args) { eye_left(); }
+void op_head_center(const uint8_t *args) { head_center(); }
+void op_head_nod(const uint8_t *args) { head_nod(3); }
+void op_head_shake(const uint8_t *args) { head_shake(3); }
+void op_head_roll(const uint8_t *args) { head_roll(30); }
+void op_head_move(const uint8_t *args) {
+  head_move((int8_t)args[0], (int8_t)args[1], (int)(args[2] | (args[3] << 8)));
+}
+
+const OpEntry op_table[] = {
+  {0x01, 0, op_eye_blink},
+  {0x02, 0, op_eye_happy},
+  {0x03, 0, op_eye_sad},
+  {0x04, 0, op_eye_anger},
+  {0x05, 0, op_eye_surprise},
+  {0x06, 0, op_eye_right},
+  {0x07, 0, op_eye_left},
+  {0x10, 0, op_head_center},
+  {0x11, 0, op_head_nod},
+  {0x12, 0, op_head_shake},
+  {0x13, 0, op_head_roll},
+  {0x14, 4, op_head_move},
+};
+const int op_table_size = sizeof(op_table) / sizeof(op_table[0]);
+
+uint8_t crc8(const uint8_t *data, uint8_t len) {
+  uint8_t crc = 0;
+  for (uint8_t i = 0; i < len; i++) {
+    crc ^= data[i];
+    for (uint8_t bit = 0; bit < 8; bit++) {
+      crc = (crc & 0x80) ? (uint8_t)((crc << 1) ^ 0x07) : (uint8_t)(crc << 1);
+    }
+  }
+  return crc;
+}
+
+void send_ack(uint8_t seq, uint8_t status) {
+  uint8_t frame[6] = {FRAME_SYNC, 3, OP_ACK, seq, status, 0};
+  frame[5] = crc8(frame + 1, 4);
+  Serial.write(frame, sizeof(frame));
+}
+
+void handle_frame() {
+  // Static buffer, no String / heap allocation on this path
+  static uint8_t frame[FRAME_MAX];
+  Serial.read();  // sync byte
+  if (Serial.readBytes(frame, 1) != 1) return;
+  uint8_t len = frame[0];
+  if (len < 2 || len + 2 > FRAME_MAX) return;
+  if (Serial.readBytes(frame + 1, len + 1) != (size_t)(len + 1)) return;
+
+  uint8_t op = frame[1];
+  uint8_t seq = frame[2];
+  if (crc8(frame, len + 1) != frame[len + 1]) {
+    send_ack(seq, STATUS_BAD_CRC);
+    return;
+  }
+  for (int i = 0; i < op_table_size; i++) {
+    if (op_table[i].op == op && op_table[i].argc == len - 2) {
+      op_table[i].handler(frame + 3);
+      send_ack(seq, STATUS_OK);
+      return;
+    }
+  }
+  send_ack(seq, STATUS_UNKNOWN);
+}
+
 void setup() {
 
   Serial.begin(115200);
@@ -446,11 +539,18 @@ void setup() {
 }
 
 void loop() {  
-  if (Serial.available() > 0) {  
+  if (Serial.available() > 0 && Serial.peek() == FRAME_SYNC) {
+    handle_frame();
+  } else if (Serial.available() > 0) {  
     String cmd = Serial.readStringUntil('\n');  
     cmd.trim();  
 
-    if (cmd == "eye_blink") {  
+    if (cmd == "proto") {
+      // Version negotiation, the host switches to binary frames on this reply
+      Serial.print("proto ");
+      Serial.println(PROTO_VERSION);
+      return;
+    } else if (cmd == "eye_blink") {  
       eye_blink();
     } else if (cmd == "eye_happy") {  
       eye_happy();
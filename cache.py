@@ -0,0 +1,489 @@
+import hashlib
+import threading
+import time
+import re
+import zlib
+from collections import OrderedDict
+
+from common import *
+
+
+class DebouncedSaver(object):
+    """Run save() on a background timer at most once every delay seconds after a change, and
+    once more at exit, so that a put on the chat thread never waits for the disk."""
+
+    def __init__(self, save, delay=2.0):
+        self.save = save
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.timer = None
+        atexit.register(self.flush)
+
+    def schedule(self):
+        with self.lock:
+            if self.timer is None:
+                self.timer = threading.Timer(self.delay, self._run)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def _run(self):
+        with self.lock:
+            self.timer = None
+        self.save()
+
+    def flush(self):
+        """Save now if a save is pending."""
+        with self.lock:
+            timer, self.timer = self.timer, None
+        if timer is not None:
+            timer.cancel()
+            self.save()
+
+
+class ResponseCache(object):
+    """Exact-match LRU cache of chat responses with per-entry TTL and optional JSON persistence."""
+
+    def __init__(self, max_entries=512, ttl=24 * 3600, path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.enabled = True
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saver = DebouncedSaver(self.save)
+        if self.path:
+            self.load()
+
+    @staticmethod
+    def normalize(message):
+        message = " ".join(message.strip().lower().split())
+        return message.rstrip("。.!！?？~～ ")
+
+    @classmethod
+    def make_key(cls, model, temperature, message, prompt):
+        prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        raw = json.dumps([model, round(float(temperature), 3), cls.normalize(message), prompt_hash], ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, ttl=None):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.entries[key] = (time.time() + (self.ttl if ttl is None else ttl), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        if self.path:
+            self.saver.schedule()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        if self.path:
+            self.saver.schedule()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as fp:
+                data = json.load(fp)
+            now = time.time()
+            with self.lock:
+                for key, expires_at, value in data:
+                    if expires_at >= now:
+                        self.entries[key] = (expires_at, value)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+            logger.info(f"Loaded {len(self.entries)} cached responses from {self.path}")
+        except Exception as e:
+            error(e, f"Failed to load response cache {self.path}")
+
+    def save(self):
+        with self.lock:
+            data = [[key, expires_at, value] for key, (expires_at, value) in self.entries.items()]
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            # 先写临时文件再替换, 避免中途退出损坏缓存文件
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as fp:
+                json.dump(data, fp, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            error(e, f"Failed to save response cache {self.path}")
+
+    @property
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+# 语义匹配前去掉的礼貌用语和虚词, 改写的指令去掉它们后大多只剩相同的内容词
+stop_words = set("a an the please pls kindly can could would will you your me my i to for of some now just "
+                 "again and then is are whats like do does it this that be".split())
+filler_words = ["your head", "请你", "请", "麻烦", "帮我", "给我", "跟我", "和我", "你能", "能不能", "可以", "一下", "一个", "一部", "一首",
+                "个", "吧", "呀", "啊", "哦", "嘛", "呢", "吗", "的", "再", "来"]
+_filler_re = re.compile("|".join(sorted(filler_words, key=len, reverse=True)))
+_word_re = re.compile(r"[a-z]+|\d+|[^\W\d_a-z]+|[+\-*/]")
+# 字面相近但数字或否定不同的指令 (5 分钟 / 6 分钟, 点头 / 不要点头) 不能共用回答
+_number_re = re.compile(r"\d+|[零一二两三四五六七八九十百千万半]")
+_negation_re = re.compile(r"\b(?:not|no|never|dont|doesnt|cant|stop)\b|[不别没勿]")
+
+
+def content_text(text):
+    """text without punctuation, polite words and fillers, words separated by spaces."""
+    text = _filler_re.sub(" ", text.lower().replace("'", ""))
+    return " ".join(word for word in _word_re.findall(text) if word not in stop_words)
+
+
+def same_numbers_and_negation(a, b):
+    """Whether two content texts have the same numbers and negations."""
+    return set(_number_re.findall(a)) == set(_number_re.findall(b)) and \
+        set(_negation_re.findall(a)) == set(_negation_re.findall(b))
+
+
+def _import_numpy():
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        return None
+
+
+class SemanticCache(object):
+    """Approximate cache of parsed chat responses ({"answer", "actions"}) for paraphrased
+    instructions. Each instruction is embedded offline as a signed feature-hashed bag of
+    character n-grams; all vectors live in one NumPy matrix and a lookup is a single
+    matrix-vector product over it. Entries are grouped by scope (model + prompt) and only
+    entries of the same scope can match. Polite words and fillers are dropped before
+    embedding (content_text), and a match is vetoed when the numbers or negations differ.
+    The default threshold is calibrated on the paraphrase set of `benchmark.py semantic`."""
+
+    eviction_policies = ("lru", "lfu", "fifo")
+
+    def __init__(self, capacity=2048, threshold=0.88, eviction="lru", dim=256, ngrams=(1, 2, 3), path=None):
+        if eviction not in self.eviction_policies:
+            raise ValueError(f"Unknown eviction policy: {eviction}, choose from {', '.join(self.eviction_policies)}")
+        self.capacity = capacity
+        self.threshold = threshold
+        self.eviction = eviction
+        self.dim = dim
+        self.ngrams = ngrams
+        self.path = path
+        self.np = _import_numpy()
+        self.enabled = self.np is not None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.vetoes = 0
+        self.saver = DebouncedSaver(self.save)
+        if not self.enabled:
+            logger.warning("numpy is not installed, semantic response cache disabled")
+            return
+        np = self.np
+        self.matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self.scopes = np.full(capacity, -1, dtype=np.int32)
+        self.last_used = np.zeros(capacity, dtype=np.int64)
+        self.inserted = np.zeros(capacity, dtype=np.int64)
+        self.use_count = np.zeros(capacity, dtype=np.int64)
+        self.texts = [None] * capacity
+        self.values = [None] * capacity
+        self.slots = {}  # (scope, text) -> slot
+        self.scope_ids = {}
+        self.size = 0
+        self.tick = 0
+        if self.path:
+            self.load()
+
+    @staticmethod
+    def normalize(message):
+        return re.sub(r"[^\w\s]", "", ResponseCache.normalize(message))
+
+    def embed(self, message):
+        vector = self.np.zeros(self.dim, dtype=self.np.float32)
+        text = f" {content_text(self.normalize(message))} "
+        for n in self.ngrams:
+            for i in range(len(text) - n + 1):
+                h = zlib.crc32(text[i:i + n].encode('utf-8'))
+                # 哈希的最高位决定符号, 冲突的特征互相抵消而不是累加
+                vector[h % self.dim] += -1.0 if h & 0x80000000 else 1.0
+        norm = self.np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _scope_id(self, scope):
+        if scope not in self.scope_ids:
+            self.scope_ids[scope] = len(self.scope_ids)
+        return self.scope_ids[scope]
+
+    def get(self, message, scope="", accept=None):
+        """Return (value, matched_message, similarity) of the most similar entry at or above
+        the threshold, otherwise None. accept(matched_message) can veto a match."""
+        if not self.enabled:
+            return None
+        query = self.embed(message)
+        with self.lock:
+            self.tick += 1
+            if self.size and scope in self.scope_ids:
+                similarity = self.matrix[:self.size] @ query
+                if len(self.scope_ids) > 1:
+                    similarity[self.scopes[:self.size] != self.scope_ids[scope]] = -1.0
+                slot = int(similarity.argmax())
+                if similarity[slot] >= self.threshold and not same_numbers_and_negation(
+                        content_text(self.normalize(message)), content_text(self.texts[slot])):
+                    self.vetoes += 1
+                elif similarity[slot] >= self.threshold and (accept is None or accept(self.texts[slot])):
+                    self.last_used[slot] = self.tick
+                    self.use_count[slot] += 1
+                    self.hits += 1
+                    return self.values[slot], self.texts[slot], float(similarity[slot])
+            self.misses += 1
+            return None
+
+    def _victim(self):
+        np = self.np
+        if self.eviction == "fifo":
+            return int(self.inserted.argmin())
+        if self.eviction == "lfu":
+            # 使用次数相同的条目中淘汰最久未使用的
+            return int(np.lexsort((self.last_used, self.use_count))[0])
+        return int(self.last_used.argmin())
+
+    def put(self, message, value, scope="", save=True):
+        if not self.enabled:
+            return
+        vector = self.embed(message)
+        text = self.normalize(message)
+        with self.lock:
+            self.tick += 1
+            slot = self.slots.get((scope, text))
+            if slot is None:
+                if self.size < self.capacity:
+                    slot = self.size
+                    self.size += 1
+                else:
+                    slot = self._victim()
+                    del self.slots[(self.scopes_by_id[self.scopes[slot]], self.texts[slot])]
+                    self.evictions += 1
+                self.slots[(scope, text)] = slot
+                self.inserted[slot] = self.tick
+                self.use_count[slot] = 0
+            self.matrix[slot] = vector
+            self.scopes[slot] = self._scope_id(scope)
+            self.last_used[slot] = self.tick
+            self.texts[slot] = text
+            self.values[slot] = value
+        if self.path and save:
+            self.saver.schedule()
+
+    @property
+    def scopes_by_id(self):
+        return {scope_id: scope for scope, scope_id in self.scope_ids.items()}
+
+    def clear(self):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.scopes[:] = -1
+            self.texts = [None] * self.capacity
+            self.values = [None] * self.capacity
+            self.slots.clear()
+            self.size = 0
+        if self.path:
+            self.saver.schedule()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as fp:
+                data = json.load(fp)
+            # 只保存文字, 载入时重新计算向量, 修改维度或 n-gram 后旧缓存仍然可用
+            for scope, message, value in data[-self.capacity:]:
+                self.put(message, value, scope, save=False)
+            logger.info(f"Loaded {self.size} semantic cache entries from {self.path}")
+        except Exception as e:
+            error(e, f"Failed to load semantic cache {self.path}")
+
+    def save(self):
+        with self.lock:
+            scopes = self.scopes_by_id
+            order = sorted(range(self.size), key=lambda slot: self.last_used[slot])
+            data = [[scopes[self.scopes[slot]], self.texts[slot], self.values[slot]] for slot in order]
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as fp:
+                json.dump(data, fp, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            error(e, f"Failed to save semantic cache {self.path}")
+
+    @property
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "entries": self.size if self.enabled else 0,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "vetoes": self.vetoes,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+class AudioCache(object):
+    """Content-addressed cache of synthesized speech: a small in-memory LRU for the hottest
+    clips in front of a size-bounded LRU directory on disk."""
+
+    def __init__(self, directory, max_disk_bytes=200 * 1024 * 1024, max_memory_bytes=16 * 1024 * 1024):
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self.enabled = True
+        self.memory = OrderedDict()  # key -> bytes
+        self.memory_bytes = 0
+        self.disk = OrderedDict()  # key -> size, 按最近使用排序
+        self.disk_bytes = 0
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._scan()
+
+    @staticmethod
+    def make_key(provider, model, voice, text, response_format="mp3"):
+        raw = json.dumps([provider, model, voice, response_format, text], ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.audio")
+
+    def _scan(self):
+        if not os.path.isdir(self.directory):
+            return
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".audio"):
+                stat = os.stat(os.path.join(self.directory, name))
+                files.append((stat.st_mtime, name[:-len(".audio")], stat.st_size))
+        for _, key, size in sorted(files):
+            self.disk[key] = size
+            self.disk_bytes += size
+
+    def _remember(self, key, audio):
+        if len(audio) > self.max_memory_bytes:
+            return
+        if key in self.memory:
+            self.memory_bytes -= len(self.memory.pop(key))
+        self.memory[key] = audio
+        self.memory_bytes += len(audio)
+        while self.memory_bytes > self.max_memory_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        with self.lock:
+            audio = self.memory.get(key)
+            if audio is not None:
+                self.memory.move_to_end(key)
+                if key in self.disk:
+                    self.disk.move_to_end(key)
+                self.memory_hits += 1
+                return audio
+            if key not in self.disk:
+                self.misses += 1
+                return None
+        try:
+            with open(self._path(key), 'rb') as fp:
+                audio = fp.read()
+            # 修改时间作为磁盘 LRU 的使用时间, 重启后依然有效
+            os.utime(self._path(key))
+        except OSError:
+            with self.lock:
+                self.disk_bytes -= self.disk.pop(key, 0)
+                self.misses += 1
+            return None
+        with self.lock:
+            if key in self.disk:
+                self.disk.move_to_end(key)
+            self._remember(key, audio)
+            self.disk_hits += 1
+        return audio
+
+    def put(self, key, audio):
+        if not self.enabled or not audio:
+            return
+        try:
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+            tmp_path = f"{self._path(key)}.tmp"
+            with open(tmp_path, 'wb') as fp:
+                fp.write(audio)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.warning(f"Failed to write audio cache: {e}")
+            return
+        evicted = []
+        with self.lock:
+            self._remember(key, audio)
+            self.disk_bytes -= self.disk.pop(key, 0)
+            self.disk[key] = len(audio)
+            self.disk_bytes += len(audio)
+            while self.disk_bytes > self.max_disk_bytes and len(self.disk) > 1:
+                old_key, size = self.disk.popitem(last=False)
+                self.disk_bytes -= size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    @property
+    def stats(self):
+        with self.lock:
+            return {
+                "memory_entries": len(self.memory),
+                "memory_bytes": self.memory_bytes,
+                "disk_entries": len(self.disk),
+                "disk_bytes": self.disk_bytes,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
@@ -1,38 +1,71 @@
 import os
+import atexit
 import logging
+import queue
+import threading
+import time
 import json
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
 
 
 # Set Version
 VERSION = "v1.2.1"
 
 ## Set logger
-log_directory = 'logs'
-if not os.path.exists(log_directory):
-    os.makedirs(log_directory)
-logger = logging.getLogger('Logger')
-logger.setLevel(logging.DEBUG)
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread, where each handler
+    checks its own level first, so the caller never pays for formatting or file I/O."""
+
+    def prepare(self, record):
+        if record.exc_info:
+            # 异常对象不跨线程传递, 先转成文本
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
 
-debug_handler = logging.FileHandler(os.path.join(log_directory, 'debug.log'))
-debug_handler.setLevel(logging.DEBUG)
-debug_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+def create_log_handlers(log_directory, max_bytes=10 * 1024 * 1024, backup_count=5):
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
 
-error_handler = logging.FileHandler(os.path.join(log_directory, 'error.log'))
-error_handler.setLevel(logging.ERROR)
-error_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    # 调试日志按大小轮转, 信息日志每天轮转, 错误日志按大小轮转并保留更多份
+    debug_handler = RotatingFileHandler(os.path.join(log_directory, 'debug.log'), maxBytes=max_bytes,
+                                        backupCount=backup_count, encoding='utf-8', delay=True)
+    debug_handler.setLevel(logging.DEBUG)
+    debug_handler.setFormatter(formatter)
 
-info_handler = logging.FileHandler(os.path.join(log_directory, 'info.log'))
-info_handler.setLevel(logging.INFO)
-info_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    error_handler = RotatingFileHandler(os.path.join(log_directory, 'error.log'), maxBytes=max_bytes,
+                                        backupCount=backup_count * 2, encoding='utf-8', delay=True)
+    error_handler.setLevel(logging.ERROR)
+    error_handler.setFormatter(formatter)
 
-stream_handler = logging.StreamHandler()
-stream_handler.setLevel(logging.INFO)
-stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+    info_handler = TimedRotatingFileHandler(os.path.join(log_directory, 'info.log'), when='midnight',
+                                            backupCount=backup_count * 6, encoding='utf-8', delay=True)
+    info_handler.setLevel(logging.INFO)
+    info_handler.setFormatter(formatter)
 
-logger.addHandler(debug_handler)
-logger.addHandler(error_handler)
-logger.addHandler(info_handler)
-logger.addHandler(stream_handler)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setLevel(logging.INFO)
+    stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+
+    return [debug_handler, error_handler, info_handler, stream_handler]
+
+
+def setup_logger(logger, handlers):
+    """Route logger through a queue drained by a background QueueListener."""
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(DeferredQueueHandler(log_queue))
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+log_directory = 'logs'
+if not os.path.exists(log_directory):
+    os.makedirs(log_directory)
+logger = logging.getLogger('Logger')
+logger.setLevel(logging.DEBUG)
+log_listener = setup_logger(logger, create_log_handlers(log_directory))
 
 
 # Command button list
@@ -133,6 +166,43 @@ My instruction: Smile. Your response: {"answer": "今天真开心", "actions": [
 """
 
 
+# 子系统名 -> 初始化耗时 (秒), 由 LazyObject 记录
+startup_timings = {}
+
+
+class LazyObject(object):
+    """Proxy that builds the wrapped object on first attribute access, so that module
+    level singletons cost nothing until they are used."""
+
+    def __init__(self, factory, *args, **kwargs):
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_args', args)
+        object.__setattr__(self, '_kwargs', kwargs)
+        object.__setattr__(self, '_instance', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    @property
+    def _initialized(self):
+        return self._instance is not None
+
+    def _get(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    start_time = time.perf_counter()
+                    instance = self._factory(*self._args, **self._kwargs)
+                    startup_timings[self._factory.__name__] = time.perf_counter() - start_time
+                    logger.debug(f"Initialized {self._factory.__name__} in {startup_timings[self._factory.__name__] * 1000:.1f} ms")
+                    object.__setattr__(self, '_instance', instance)
+        return self._instance
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._get(), name, value)
+
+
 def error(e="", msg=""):
     print(f"[Error] {msg}. See details in logs/error.log")
     logger.error(msg)
@@ -1,14 +1,275 @@
-import inquirer
 import platform
 import serial
 import serial.tools.list_ports
 import asyncio
 import threading
+import struct
 import time
-from bleak import BleakClient, BleakScanner
+from collections import deque, namedtuple
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 import os
 
 from common import *
+from metrics import metrics
+
+
+Frame = namedtuple("Frame", ["op", "seq", "args"])
+
+
+class BinaryProtocol(object):
+    """Framed binary commands: SYNC | LEN | OP | SEQ | ARGS | CRC8, where LEN counts OP+SEQ+ARGS
+    and the CRC covers LEN..ARGS. The firmware answers every frame with an ACK frame
+    carrying the same SEQ and a status byte. Opcodes must match board/board.ino."""
+
+    VERSION = 1
+    SYNC = 0xA5
+    OP_ACK = 0x80
+    STATUS_OK = 0
+    STATUS_UNKNOWN = 1
+    STATUS_BAD_CRC = 2
+
+    opcodes = {
+        "eye_blink": 0x01,
+        "eye_happy": 0x02,
+        "eye_sad": 0x03,
+        "eye_anger": 0x04,
+        "eye_surprise": 0x05,
+        "eye_right": 0x06,
+        "eye_left": 0x07,
+        "head_center": 0x10,
+        "head_nod": 0x11,
+        "head_shake": 0x12,
+        "head_roll": 0x13,
+        "head_move": 0x14,
+    }
+    # opcode -> struct 格式, 参数为小端的 int8/int16
+    arg_formats = {
+        0x14: "<bbH",  # x_offset, y_offset, servo_delay
+        OP_ACK: "<B",  # status
+    }
+
+    def __init__(self):
+        self.seq = 0
+
+    @staticmethod
+    def crc8(data):
+        crc = 0
+        for byte in data:
+            crc ^= byte
+            for _ in range(8):
+                crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        return crc
+
+    def next_seq(self):
+        self.seq = (self.seq + 1) & 0xFF
+        return self.seq
+
+    def encode_frame(self, op, seq, args=()):
+        payload = struct.pack(self.arg_formats.get(op, "<"), *args)
+        body = bytes([len(payload) + 2, op, seq]) + payload
+        return bytes([self.SYNC]) + body + bytes([self.crc8(body)])
+
+    def encode(self, command, seq=None):
+        """Encode a firmware command line, returns (seq, frame) or None if it has no opcode."""
+        name, *params = command.split()
+        op = self.opcodes.get(name)
+        if op is None:
+            return None
+        try:
+            args = [int(param) for param in params]
+            seq = self.next_seq() if seq is None else seq
+            return seq, self.encode_frame(op, seq, args)
+        except (ValueError, struct.error):
+            return None
+
+    def decode(self, buffer):
+        """Decode one frame from the start of buffer, returns (frame, consumed_bytes).
+        frame is None and consumed is 0 while the frame is incomplete; a corrupt frame
+        returns (None, 1) so the caller can resync on the next byte."""
+        if len(buffer) < 2:
+            return None, 0
+        length = buffer[1]
+        if length < 2:
+            return None, 1
+        if len(buffer) < length + 3:
+            return None, 0
+        body = bytes(buffer[1:length + 2])
+        if self.crc8(body) != buffer[length + 2]:
+            return None, 1
+        op, seq, payload = body[1], body[2], body[3:]
+        fmt = self.arg_formats.get(op)
+        args = struct.unpack(fmt, payload) if fmt and struct.calcsize(fmt) == len(payload) else tuple(payload)
+        return Frame(op, seq, args), length + 3
+
+
+class StreamFramer(object):
+    """Split a byte stream from the device into text lines and binary frames."""
+
+    def __init__(self, protocol=None):
+        self.protocol = protocol or BinaryProtocol()
+        self.buffer = b''
+
+    def feed(self, data):
+        self.buffer += data
+        messages = []
+        while self.buffer:
+            # 二进制帧只可能出现在行首, 0xA5 不会是 UTF-8 字符的首字节
+            if self.buffer[0] == BinaryProtocol.SYNC:
+                frame, consumed = self.protocol.decode(self.buffer)
+                if not consumed:
+                    break
+                self.buffer = self.buffer[consumed:]
+                if frame:
+                    messages.append(frame)
+                continue
+            # 按行切分, 不完整的行留到下次
+            index = self.buffer.find(b'\n')
+            if index < 0:
+                break
+            line, self.buffer = self.buffer[:index], self.buffer[index + 1:]
+            line = line.decode('utf-8', errors='ignore').strip()
+            if line:
+                messages.append(line)
+        return messages
+
+
+def ack_matcher(command, seq=None):
+    """Match the firmware's acknowledgement of command: the ACK frame with seq in binary
+    mode, the echoed line (or 'Unknown command: <cmd>') in text mode."""
+    if seq is not None:
+        return lambda reply: isinstance(reply, Frame) and reply.op == BinaryProtocol.OP_ACK and reply.seq == seq
+    return lambda reply: isinstance(reply, str) and (reply == command or reply == f"Unknown command: {command}")
+
+
+def reply_ok(reply):
+    """Whether a firmware reply (echoed text line or ACK frame) means the command ran."""
+    if isinstance(reply, Frame):
+        return reply.args[:1] == (BinaryProtocol.STATUS_OK,)
+    return not reply.startswith("Unknown command")
+
+
+class SerialTransport(object):
+    """One blocking reader thread per port. Incoming bytes are framed into lines, each line
+    resolves the oldest pending request whose matcher accepts it, anything else (boot
+    messages, print_angle output ...) is published to subscribers. When a read fails (the
+    board was unplugged) the pending requests fail with the error and on_disconnect is called."""
+
+    def __init__(self, ser, on_disconnect=None):
+        self.ser = ser
+        self.on_disconnect = on_disconnect
+        self.protocol = BinaryProtocol()
+        self.pending = deque()  # (match, future)
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._read_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        with self.lock:
+            pending, self.pending = self.pending, deque()
+        for _, future in pending:
+            future.cancel()
+
+    def _read_loop(self):
+        framer = StreamFramer(self.protocol)
+        while self.running:
+            try:
+                # read(1) 阻塞在系统调用上直到有数据或超时, 空闲时不占用 CPU
+                data = self.ser.read(1)
+                if not data:
+                    continue
+                data += self.ser.read(self.ser.in_waiting)
+            except Exception as e:
+                if self.running:
+                    error(e, "Serial port read Failed!")
+                    self._lost(e)
+                break
+            received_at = time.time()
+            for message in framer.feed(data):
+                self._dispatch(message, received_at)
+
+    def _lost(self, exception):
+        self.running = False
+        with self.lock:
+            pending, self.pending = self.pending, deque()
+        for _, future in pending:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(exception)
+        if self.on_disconnect:
+            try:
+                self.on_disconnect(exception)
+            except Exception as e:
+                error(e, "Serial disconnect callback Failed!")
+
+    def _dispatch(self, line, received_at):
+        """line is a text line (str) or a decoded binary Frame."""
+        logger.debug(f"Received: {line}")
+        with self.lock:
+            for item in self.pending:
+                match, future = item
+                if match(line):
+                    self.pending.remove(item)
+                    break
+            else:
+                future = None
+        if future is not None:
+            # 请求方可能刚好超时取消, 此时丢弃这一行
+            if future.set_running_or_notify_cancel():
+                future.set_result((line, received_at))
+            return
+        for callback in list(self.subscribers):
+            try:
+                callback(line)
+            except Exception as e:
+                error(e, "Serial subscriber Failed!")
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+
+    def write(self, data):
+        with self.write_lock:
+            self.ser.write(data)
+        metrics.inc("bytes_sent_total", len(data), transport="serial")
+
+    def request(self, line, match=None):
+        """Write line and return a Future resolved with (reply, received_at) by the
+        first reply accepted by match (any reply by default)."""
+        return self.request_bytes(line.rstrip('\n').encode('utf-8') + b'\n', match)
+
+    def request_bytes(self, data, match=None):
+        future = Future()
+        with self.lock:
+            self.pending.append((match or (lambda reply: True), future))
+        try:
+            self.write(data)
+            logger.debug(f"Sent: {data}")
+        except Exception:
+            self.cancel(future)
+            raise
+        return future
+
+    def cancel(self, future):
+        with self.lock:
+            for item in self.pending:
+                if item[1] is future:
+                    self.pending.remove(item)
+                    break
+        future.cancel()
+
+
+# setup() 结束时固件打印的欢迎语, 打开串口会让 ESP32 复位, 看到它之后固件才开始处理命令
+BOOT_BANNER = "Hello, I am Desk-Emoji"
 
 
 class SerialClient(object):
@@ -18,6 +279,9 @@ class SerialClient(object):
         self.ser = None
         self.connected = False
         self.baud = 115200
+        self.transport = None
+        self.use_binary = True  # 固件支持时使用二进制协议
+        self.protocol_version = 0  # 0 表示文本协议
 
     def __unique_ports(self, ports):
         port_list = []
@@ -33,6 +297,8 @@ class SerialClient(object):
         return self.__unique_ports(matching_ports + non_matching_ports)
 
     def select_port(self):
+        import inquirer
+
         ports = self.list_ports()
         if len(ports) == 1:
             return ports[0]
@@ -61,8 +327,7 @@ class SerialClient(object):
             self.connected = True
             
             # 创建独立线程读取数据
-            self.thread = threading.Thread(target=self.read, args=(self.ser,), daemon=True)
-            self.thread.start()
+            self._start_transport()
             
             logger.info(f"Connected to {port}.")
             return True
@@ -100,8 +365,7 @@ class SerialClient(object):
                     self.connected = True
                     
                     # 创建独立线程读取数据
-                    self.thread = threading.Thread(target=self.read, args=(self.ser,), daemon=True)
-                    self.thread.start()
+                    self._start_transport()
                     
                     logger.info(f"Connected to {port} using exclusive mode.")
                     return True
@@ -111,7 +375,60 @@ class SerialClient(object):
                 error(e, f"Connect to {port} Failed")
                 return False
 
+    def _start_transport(self):
+        self.transport = SerialTransport(self.ser, on_disconnect=self._on_lost)
+        self.transport.subscribe(lambda line: logger.info(f"Device: {line}"))
+        self.transport.subscribe(self._on_boot_line)
+        self.transport.start()
+        self.protocol_version = self.negotiate_protocol() if self.use_binary else 0
+
+    def _on_boot_line(self, line):
+        """Opening the port resets the board, so the first 'proto' is usually sent while
+        setup() is still running: adopt its late reply, or ask again after the boot banner."""
+        if not self.use_binary or not isinstance(line, str):
+            return
+        if line.startswith("proto ") and not self.protocol_version:
+            self.protocol_version = self._parse_version(line)
+            logger.info(f"Serial protocol: binary v{self.protocol_version} (late reply)")
+        elif line.startswith(BOOT_BANNER):
+            # 回调在读线程中执行, 协商需要等读线程收到回复, 放到新线程
+            threading.Thread(target=self._renegotiate, daemon=True).start()
+
+    def _renegotiate(self):
+        transport = self.transport
+        version = self.negotiate_protocol()
+        if transport is self.transport:
+            self.protocol_version = version
+
+    @staticmethod
+    def _parse_version(reply):
+        try:
+            return min(int(reply.split()[1]), BinaryProtocol.VERSION)
+        except (IndexError, ValueError):
+            return 0
+
+    def negotiate_protocol(self, timeout=1):
+        """Ask the firmware for its binary protocol version, old firmware answers
+        'Unknown command: proto' (or nothing) and we stay on the text protocol."""
+        future = self.request("proto", match=lambda reply: isinstance(reply, str) and
+                              (reply.startswith("proto ") or reply == "Unknown command: proto"))
+        try:
+            reply, _ = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            self.cancel(future)
+            reply = ""
+        version = self._parse_version(reply) if reply.startswith("proto ") else 0
+        logger.info(f"Serial protocol: {'binary v%d' % version if version else 'text'}")
+        return version
+
+    def _on_lost(self, exception):
+        logger.warning(f"Lost serial port {self.port}: {exception}")
+        self.connected = False
+
     def disconnect(self):
+        if self.transport:
+            self.transport.stop()
+            self.transport = None
         if self.ser and self.ser.is_open:
             try:
                 self.ser.close()
@@ -123,60 +440,313 @@ class SerialClient(object):
         self.connected = False
         self.ser = None
 
-    def read(self, port):
-        while True:
-            if port.in_waiting:
-                data = port.read(port.in_waiting)
-                result = data.decode('utf-8', errors='ignore')
-                logger.debug("\nReceived:", result.strip('\n').strip())
+    def request(self, line, match=None):
+        return self.transport.request(line, match)
+
+    def send_command(self, command):
+        """Send one firmware command line, returns a Future resolved with (reply, received_at)
+        once the firmware acknowledges it (ACK frame or echoed line)."""
+        encoded = self.transport.protocol.encode(command) if self.protocol_version else None
+        if encoded is None:
+            return self.request(command, match=ack_matcher(command))
+        seq, frame = encoded
+        return self.transport.request_bytes(frame, match=ack_matcher(command, seq))
 
-    def send(self, msg):
+    def cancel(self, future):
+        self.transport.cancel(future)
+
+    def send(self, msg, timeout=2):
         try:
-            encode_msg = msg.encode('utf-8')
-            self.ser.write(encode_msg)
-            logger.debug(f"Sent: {msg}")
-            # 发送后添加换行符，确保命令能被设备正确接收
-            if not msg.endswith('\n'):
-                self.ser.write(b'\n')
+            # 发送时添加换行符，确保命令能被设备正确接收
+            future = self.request(msg)
             
             # 简化回应检测逻辑，不要期望完全相同的回应
-            start_time = time.time()
-            while time.time() - start_time < 2:  # 等待2秒
-                if self.ser.in_waiting > 0:
-                    response = self.ser.read(self.ser.in_waiting).decode('utf-8', errors='ignore')
-                    logger.debug(f"Received: {response}")
-                    return response
-                time.sleep(0.1)
-            
-            return None  # 超时返回
+            try:
+                response, _ = future.result(timeout=timeout)
+                return response
+            except FutureTimeoutError:
+                self.cancel(future)
+                return None  # 超时返回
         except Exception as e:
             error(e, "Serial port send message Failed!")
             self.connected = False
             return None
 
 
+class BleakBackend(object):
+    """BLE link through bleak."""
+
+    def __init__(self, address):
+        # bleak 导入较慢, 推迟到第一次使用蓝牙时
+        from bleak import BleakClient
+
+        self.client = BleakClient(address)
+
+    async def connect(self):
+        await self.client.connect()
+
+    async def disconnect(self):
+        await self.client.disconnect()
+
+    @property
+    def is_connected(self):
+        return self.client.is_connected
+
+    @property
+    def mtu(self):
+        return self.client.mtu_size
+
+    async def write(self, uuid, data, response=True):
+        await self.client.write_gatt_char(uuid, data, response=response)
+
+    async def start_notify(self, uuid, callback):
+        await self.client.start_notify(uuid, lambda sender, data: callback(bytes(data)))
+
+
+class FakeBleBackend(object):
+    """In-process stand-in for a Desk-Emoji BLE peripheral, so the send path can be
+    benchmarked without a radio. Writes cost one connection interval (two with response),
+    commands run one after another for command_time seconds and are acknowledged on the
+    notify characteristic with the same echo / ACK frame the serial firmware sends."""
+
+    def __init__(self, address="fake", mtu=185, interval=0.0075, command_time=0.0):
+        self.address = address
+        self.mtu = mtu
+        self.interval = interval
+        self.command_time = command_time
+        self.is_connected = False
+        self.notify_callback = None
+        self.framer = StreamFramer()
+        self.commands = None
+        self.worker = None
+        self.writes = 0
+        self.bytes_written = 0
+
+    async def connect(self):
+        self.commands = asyncio.Queue()
+        self.worker = asyncio.ensure_future(self._run_commands())
+        self.is_connected = True
+
+    async def disconnect(self):
+        if self.worker:
+            self.worker.cancel()
+        self.is_connected = False
+
+    async def write(self, uuid, data, response=True):
+        if len(data) > self.mtu - 3 and not response:
+            raise ValueError(f"Write without response of {len(data)} bytes exceeds MTU {self.mtu}")
+        await asyncio.sleep(self.interval * (2 if response else 1))
+        self.writes += 1
+        self.bytes_written += len(data)
+        for message in self.framer.feed(data if data.endswith(b'\n') or data[:1] == b'\xa5' else data + b'\n'):
+            self.commands.put_nowait(message)
+
+    async def start_notify(self, uuid, callback):
+        self.notify_callback = callback
+
+    async def _run_commands(self):
+        protocol = BinaryProtocol()
+        while True:
+            message = await self.commands.get()
+            if self.command_time:
+                await asyncio.sleep(self.command_time)
+            if not self.notify_callback:
+                continue
+            if isinstance(message, Frame):
+                self.notify_callback(protocol.encode_frame(BinaryProtocol.OP_ACK, message.seq, [BinaryProtocol.STATUS_OK]))
+            else:
+                self.notify_callback(f"{message}\r\n".encode('utf-8'))
+
+
+class BleSendQueue(object):
+    """Packs queued commands into as few GATT writes as the MTU allows and resolves each
+    command's future from the acknowledgements arriving on the notify characteristic.
+    Without notifications a command counts as done once its write completes."""
+
+    def __init__(self, backend, characteristic_uuid, notify_uuid=None, with_response=False):
+        self.backend = backend
+        self.characteristic_uuid = characteristic_uuid
+        self.notify_uuid = notify_uuid
+        self.with_response = with_response
+        self.acks = False
+        self.queue = deque()  # (data, match, future)
+        self.pending = deque()  # (match, future) 等待确认
+        self.framer = StreamFramer()
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.writes = 0
+        self.commands = 0
+
+    @property
+    def max_payload(self):
+        # ATT 头占用 3 字节
+        return max((self.backend.mtu or 23) - 3, 20)
+
+    async def start(self):
+        if self.notify_uuid:
+            try:
+                await self.backend.start_notify(self.notify_uuid, self._on_notify)
+                self.acks = True
+            except Exception as e:
+                logger.warning(f"BLE notifications unavailable, acks fall back to write completion: {e}")
+        self.task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+        for _, _, future in self.queue:
+            future.cancel()
+        for _, future in self.pending:
+            future.cancel()
+        self.queue.clear()
+        self.pending.clear()
+
+    def submit(self, data, match):
+        """Queue encoded command bytes, returns an asyncio future resolved with (reply, received_at)."""
+        future = asyncio.get_event_loop().create_future()
+        self.queue.append((data, match, future))
+        self.wakeup.set()
+        return future
+
+    def _on_notify(self, data):
+        received_at = time.time()
+        for message in self.framer.feed(data):
+            # 超时或失败的命令已经结束, 先丢掉, 免得抢走后面同名命令的确认
+            self.pending = deque(item for item in self.pending if not item[1].done())
+            for item in self.pending:
+                match, future = item
+                if match(message):
+                    self.pending.remove(item)
+                    future.set_result((message, received_at))
+                    break
+            else:
+                logger.debug(f"BLE notification: {message}")
+
+    async def _run(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while self.queue:
+                batch = [self.queue.popleft()]
+                payload = batch[0][0]
+                while self.queue and len(payload) + len(self.queue[0][0]) <= self.max_payload:
+                    batch.append(self.queue.popleft())
+                    payload += batch[-1][0]
+                # 超过 MTU 的单条命令只能用带响应的长写入
+                response = self.with_response or len(payload) > self.max_payload
+                if self.acks:
+                    self.pending.extend((match, future) for _, match, future in batch)
+                try:
+                    write_start = time.perf_counter()
+                    await self.backend.write(self.characteristic_uuid, payload, response=response)
+                    self.writes += 1
+                    self.commands += len(batch)
+                    metrics.observe("write_seconds", time.perf_counter() - write_start, transport="ble")
+                    metrics.inc("bytes_sent_total", len(payload), transport="ble")
+                except Exception as e:
+                    logger.error(f"Failed to send data: {e}")
+                    metrics.inc("send_failures_total", len(batch), transport="ble")
+                    failed = set(id(future) for _, _, future in batch)
+                    self.pending = deque(item for item in self.pending if id(item[1]) not in failed)
+                    for _, _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                if not self.acks:
+                    written_at = time.time()
+                    for _, _, future in batch:
+                        if not future.done():
+                            future.set_result((None, written_at))
+
+
 class BaseBluetoothClient(object):
-    def __init__(self, device_name="", service_uuid="", characteristic_uuid=""):
+    cache_path = 'ble_device.json'  # 上次成功连接的设备, 启动时可跳过扫描直接重连
+
+    def __init__(self, device_name="", service_uuid="", characteristic_uuid="", notify_uuid=None,
+                 backend=BleakBackend):
         self.device_name = device_name
         self.service_uuid = service_uuid
         self.characteristic_uuid = characteristic_uuid
+        self.notify_uuid = notify_uuid
+        self.backend = backend
         self.client = None
+        self.send_queue = None
         self.connected = False
+        self.protocol = BinaryProtocol()
+        self.use_binary = False  # 仅在蓝牙固件支持二进制协议时开启
+        self.with_response = False  # 连续发送命令时默认使用无响应写入
+        self.timings = {}
+        self.commands_lock = None  # 在事件循环中创建, 多次 send_commands 依次执行
+
+    async def list_devices(self, max_devices=1, timeout=5.0):
+        """Scan for devices advertising our service UUID (or our name), returning as soon as
+        max_devices are found or after timeout seconds."""
+        from bleak import BleakScanner
 
-    async def list_devices(self):
         logger.info("Scanning devices...")
         device_list = []
-        devices = await BleakScanner.discover()
-        for device in devices:
-            if device.name == self.device_name:
+        found = asyncio.Event()
+        service_uuid = self.service_uuid.lower()
+
+        def on_detect(device, advertisement):
+            if device.address in device_list:
+                return
+            uuids = [uuid.lower() for uuid in advertisement.service_uuids or []]
+            if service_uuid in uuids or device.name == self.device_name or advertisement.local_name == self.device_name:
                 device_list.append(device.address)
+                if len(device_list) >= max_devices:
+                    found.set()
+
+        start_time = time.time()
+        # 不把 service_uuids 交给系统扫描过滤: 只广播名称的设备会被 BlueZ / CoreBluetooth 直接丢掉,
+        # 在回调里按 UUID 或名称筛选, 找够设备后同样提前结束
+        scanner = BleakScanner(detection_callback=on_detect)
+        await scanner.start()
+        try:
+            await asyncio.wait_for(found.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            await scanner.stop()
+        self.timings["scan"] = time.time() - start_time
+        self.timings["devices_found"] = len(device_list)
+        logger.info(f"Found {len(device_list)} devices in {self.timings['scan']:.2f} s")
         return device_list
 
+    def read_cached_address(self):
+        try:
+            with open(self.cache_path, 'r') as fp:
+                return json.load(fp).get(self.device_name, "")
+        except (OSError, ValueError):
+            return ""
+
+    def write_cached_address(self, address):
+        try:
+            with open(self.cache_path, 'w') as fp:
+                json.dump({self.device_name: address}, fp)
+        except OSError as e:
+            logger.warning(f"Failed to save {self.cache_path}: {e}")
+
+    async def reconnect_last(self):
+        """Connect straight to the last good address without scanning."""
+        address = self.read_cached_address()
+        if not address:
+            return False
+        logger.info(f"Reconnecting to cached device {address}")
+        return await self.connect(address)
+
     async def connect(self, device_address):
-        self.client = BleakClient(device_address)
+        self.client = self.backend(device_address)
+        start_time = time.time()
         try:
             await self.client.connect()
-            logger.info(f"Connected to {self.device_name} at {device_address}")
+            self.send_queue = BleSendQueue(self.client, self.characteristic_uuid, self.notify_uuid,
+                                           with_response=self.with_response)
+            await self.send_queue.start()
+            self.timings["connect"] = time.time() - start_time
+            logger.info(f"Connected to {self.device_name} at {device_address}, MTU {self.client.mtu}, "
+                        f"in {self.timings['connect']:.2f} s")
+            self.write_cached_address(device_address)
             self.connected = True
             return True
         except Exception as e:
@@ -185,6 +755,9 @@ class BaseBluetoothClient(object):
             return False
 
     async def disconnect(self):
+        if self.send_queue:
+            self.send_queue.stop()
+            self.send_queue = None
         if self.client and self.client.is_connected:
             await self.client.disconnect()
             self.connected = False
@@ -193,19 +766,86 @@ class BaseBluetoothClient(object):
     async def send(self, data):
         if self.client and self.client.is_connected:
             try:
-                await self.client.write_gatt_char(self.characteristic_uuid, data.encode('utf-8'))
+                if isinstance(data, str):
+                    data = data.encode('utf-8')
+                await self.client.write(self.characteristic_uuid, data, response=True)
                 logger.info(f"Sent to {self.device_name}: {data}")
             except Exception as e:
                 logger.error(f"Failed to send data: {e}")
         else:
             logger.info("Not connected to any device.")
 
+    def submit_command(self, command):
+        """Queue one firmware command line for batched sending, returns an asyncio future
+        resolved with (reply, received_at) once it is acknowledged."""
+        encoded = self.protocol.encode(command) if self.use_binary else None
+        if encoded:
+            seq, data = encoded
+            return self.send_queue.submit(data, ack_matcher(command, seq))
+        return self.send_queue.submit(command.encode('utf-8') + b'\n', ack_matcher(command))
+
+    async def send_commands(self, commands, host_delays=None, timing=None, position=None):
+        """Send a list of firmware command lines back-to-back, returns per-command results.
+        Calls run one after another, so a host delay in one list also holds back the next.
+        The whole list is queued at once: each ack may take ack_timeout seconds past its
+        predicted finish (from timing, an action.TimingModel) or past the previous ack."""
+        if self.commands_lock is None:
+            self.commands_lock = asyncio.Lock()
+        async with self.commands_lock:
+            results = []
+            pending = []
+            busy_until = time.time()  # 设备预计执行完已发送命令的时刻
+            for command in commands:
+                if host_delays and command in host_delays:
+                    # 主机端延时: 等之前的命令全部执行完再计时
+                    results += await self._gather(pending)
+                    pending = []
+                    await asyncio.sleep(host_delays[command])
+                    busy_until = time.time()
+                    continue
+                sent_at = time.time()
+                busy_until = max(busy_until, sent_at)
+                if timing is not None:
+                    ms, position = timing.predict_ms(command, position)
+                    busy_until += ms / 1000
+                pending.append((command, sent_at, busy_until, self.submit_command(command)))
+            results += await self._gather(pending)
+            return results
+
+    @staticmethod
+    async def _gather(pending, ack_timeout=5):
+        results = []
+        previous_ack = 0
+        for command, sent_at, finish, future in pending:
+            deadline = max(finish, previous_ack) + ack_timeout
+            # asyncio.wait 不会取消命令的 future, 这里抛出的 CancelledError 只可能是任务本身被取消
+            done, _ = await asyncio.wait([future], timeout=max(deadline - time.time(), 0))
+            if not done:
+                # 取消后发送队列会丢掉它的待确认项
+                future.cancel()
+            if not done or future.cancelled() or future.exception() is not None:
+                results.append({"command": command, "ok": False, "latency": None})
+                continue
+            reply, received_at = future.result()
+            results.append({"command": command, "ok": reply is None or reply_ok(reply),
+                            "latency": received_at - sent_at})
+            previous_ack = received_at
+        return results
+
+
+# 固件 board.ino 中的蓝牙名称和 UUID
+BLE_DEVICE_NAME = "Desk-Emoji"
+BLE_SERVICE_UUID = "4db9a22d-6db4-d9fe-4d93-38e350abdc3c"
+BLE_CHARACTERISTIC_UUID = "ff1cdaef-0105-e4fb-7be2-018500c2e927"
+
 
 class BluetoothClient(BaseBluetoothClient):
-    def __init__(self, device_name="Desk-Emoji",
-                 service_uuid="4db9a22d-6db4-d9fe-4d93-38e350abdc3c",
-                 characteristic_uuid="ff1cdaef-0105-e4fb-7be2-018500c2e927"):
-        super().__init__(device_name, service_uuid, characteristic_uuid)
+    def __init__(self, device_name=BLE_DEVICE_NAME,
+                 service_uuid=BLE_SERVICE_UUID,
+                 characteristic_uuid=BLE_CHARACTERISTIC_UUID,
+                 notify_uuid=BLE_CHARACTERISTIC_UUID,
+                 backend=BleakBackend):
+        super().__init__(device_name, service_uuid, characteristic_uuid, notify_uuid, backend)
         self.loop_thread = threading.Thread(target=self._run_event_loop)
         self.loop_thread.daemon = True
         self.loop = asyncio.new_event_loop()
@@ -215,8 +855,11 @@ class BluetoothClient(BaseBluetoothClient):
         asyncio.set_event_loop(self.loop)
         self.loop.run_forever()
 
-    def list_devices(self):
-        return asyncio.run_coroutine_threadsafe(super().list_devices(), self.loop).result()
+    def list_devices(self, max_devices=1, timeout=5.0):
+        return asyncio.run_coroutine_threadsafe(super().list_devices(max_devices, timeout), self.loop).result()
+
+    def reconnect_last(self):
+        return asyncio.run_coroutine_threadsafe(super().reconnect_last(), self.loop).result()
 
     def connect(self, device_address):
         return asyncio.run_coroutine_threadsafe(super().connect(device_address), self.loop).result()
@@ -226,3 +869,9 @@ class BluetoothClient(BaseBluetoothClient):
 
     def send(self, data):
         asyncio.run_coroutine_threadsafe(super().send(data), self.loop).result()
+
+    def send_commands(self, commands, host_delays=None, wait=True, timing=None, position=None):
+        """Queue commands without blocking per command, optionally wait for all acks."""
+        future = asyncio.run_coroutine_threadsafe(super().send_commands(commands, host_delays, timing, position),
+                                                  self.loop)
+        return future.result() if wait else future
@@ -0,0 +1,447 @@
+import asyncio
+import base64
+import hashlib
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+from common import *
+from action import ActionCompiler, ActionPipeline, TimingModel, host_delays
+from gpt import parse_response
+from metrics import metrics
+from turn import TurnCancelled, TurnExecutor, TurnOrchestrator
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC11B85"
+WS_TEXT, WS_CLOSE, WS_PING, WS_PONG = 0x1, 0x8, 0x9, 0xA
+MAX_HEADER = 16 * 1024
+MAX_BODY = 1024 * 1024
+
+
+def websocket_accept(key):
+    return base64.b64encode(hashlib.sha1((key + WS_GUID).encode('ascii')).digest()).decode('ascii')
+
+
+def encode_ws_frame(payload, opcode=WS_TEXT):
+    """A single unmasked server frame (RFC 6455)."""
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 1 << 16:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+async def read_ws_frame(reader):
+    """Read one client frame, returns (opcode, payload). Client frames are always masked."""
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length, = struct.unpack("!H", await reader.readexactly(2))
+    elif length == 127:
+        length, = struct.unpack("!Q", await reader.readexactly(8))
+    if length > MAX_BODY:
+        raise ValueError(f"WebSocket frame of {length} bytes")
+    mask = await reader.readexactly(4) if second & 0x80 else b'\x00' * 4
+    payload = bytearray(await reader.readexactly(length))
+    for i in range(length):
+        payload[i] ^= mask[i % 4]
+    return first & 0x0F, bytes(payload)
+
+
+class EventHub(object):
+    """Fan turn events out to the WebSocket clients. Every client has a bounded queue; a
+    client that falls behind loses events instead of slowing the turn down."""
+
+    def __init__(self, loop, max_queue=256):
+        self.loop = loop
+        self.max_queue = max_queue
+        self.clients = set()
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self):
+        queue = asyncio.Queue(self.max_queue)
+        self.clients.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self.clients.discard(queue)
+
+    def publish(self, event_type, **fields):
+        """Thread-safe, may be called from the turn worker threads."""
+        event = dict(type=event_type, time=round(time.time(), 3), **fields)
+        self.loop.call_soon_threadsafe(self._publish, json.dumps(event, ensure_ascii=False))
+
+    def _publish(self, message):
+        self.published += 1
+        for queue in self.clients:
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self.dropped += 1
+                metrics.inc("events_dropped_total")
+
+
+class Daemon(object):
+    """Headless Desk-Emoji: the chat turn of the App (LLM, parse, speech and motion) behind a
+    local HTTP API instead of the window.
+
+        POST /chat     {"text": "...", "speak": false, "cache": true} -> answer, actions, stage timings
+        POST /listen   record from the microphone, then run the transcript as a chat turn
+        POST /actions  {"actions": [...]} -> per-command acks
+        GET  /status   connections and counters
+        GET  /metrics  Prometheus text
+        GET  /events   WebSocket stream of turn events (turn_started, answer, action_ack, turn_finished)
+
+    Requests are parsed on one asyncio loop. Chat turns run on a TurnExecutor with workers
+    threads and a queue of max_pending: the same instruction sent by several clients at once
+    (with the same speak and cache options) is answered by one turn, and with supersede a new instruction cancels the older ones
+    (409), which suits a single user. A full queue drops its oldest turn (503). Commands from
+    concurrent turns are sent to the robot one list at a time."""
+
+    def __init__(self, llm, ser=None, blt=None, speaker=None, listener=None, host="127.0.0.1", port=8765,
+                 workers=8, voice="onyx", speak=False, max_pending=64, supersede=False):
+        self.llm = llm
+        self.ser = ser
+        self.blt = blt
+        self.speaker = speaker
+        self.listener = listener
+        self.host = host
+        self.port = port
+        self.voice = voice
+        self.speak = speak
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.turn_executor = TurnExecutor(self.run_turn, max_pending=max_pending, concurrency=workers,
+                                          supersede=supersede, name="daemon")
+        self.compiler = ActionCompiler()
+        self.timing = TimingModel()
+        self.action_budget = 10.0
+        self.send_lock = threading.Lock()
+        self.turns = TurnOrchestrator(speaker, self.send_actions)
+        self.loop = None
+        self.server = None
+        self.hub = None
+        self.thread = None
+        self.requests = 0
+        self.connections = 0
+
+    # 机器人 ------------------------------------------------------------------
+
+    @property
+    def device_connected(self):
+        return bool(self.ser and self.ser.connected) or bool(self.blt and self.blt.connected)
+
+    def send_actions(self, actions):
+        """Compile and play actions like App.send_actions, publishing an action_ack per command."""
+        if not self.device_connected:
+            return []
+        turn = metrics.current_turn()
+        turn_id = turn.id if turn else None
+
+        def on_result(result):
+            self.hub.publish("action_ack", turn=turn_id, command=result["command"], ok=result["ok"],
+                             latency=result["latency"])
+
+        # 并发的对话共用一个机器人, 动作列表整段发送, 不交错
+        with self.send_lock:
+            position = self.compiler.position
+            commands = self.compiler.compile(actions)
+            results = []
+            if self.blt and self.blt.connected:
+                self.timing.check_budget(commands, self.action_budget, position)
+                ble_results = self.blt.send_commands(commands, host_delays, timing=self.timing, position=position)
+                for result in ble_results:
+                    on_result(result)
+                results += ble_results
+            if self.ser and self.ser.connected:
+                results += ActionPipeline(self.ser, timing=self.timing, position=position, budget=self.action_budget,
+                                          on_result=on_result).run(commands)
+        return results
+
+    def run_turn(self, text, speak=None, use_cache=True, source="api"):
+        """One chat turn from instruction to motion, blocking (runs on the worker threads)."""
+        # /listen 在录音前已经开始计时
+        turn = metrics.current_turn() or metrics.start_turn(source)
+        try:
+            self.hub.publish("turn_started", turn=turn.id, text=text)
+            logger.info(f"[{turn.id}] You: {text}")
+            response = self.llm.chat(text, use_cache=use_cache)
+            with metrics.span("parse"):
+                answer, actions = parse_response(response)
+            logger.info(f"[{turn.id}] Bot: {response}")
+            self.turn_executor.check()
+            self.hub.publish("answer", turn=turn.id, answer=answer, actions=actions)
+
+            speak = self.speak if speak is None else speak
+            report = self.turns.run(answer, actions, voice=self.voice, speak=bool(speak and self.speaker))
+            timings = {stage: round(seconds, 4) for stage, seconds in turn.spans}
+            self.hub.publish("turn_finished", turn=turn.id, wall=round(report["wall"], 4), timings=timings)
+            return {"turn": turn.id, "answer": answer, "actions": actions, "timings": timings,
+                    "wall": round(report["wall"], 4)}
+        finally:
+            turn.finish()
+
+    def listen(self):
+        """Record one instruction, returns (turn, text) with the voice turn already timing."""
+        turn = metrics.start_turn("voice")
+        try:
+            text = self.listener.hear()
+        except Exception:
+            turn.finish()
+            raise
+        finally:
+            # 回合在 turn worker 上结束, 不能一直是这个线程池线程的当前回合
+            metrics.attach(None)
+        if not text:
+            turn.finish()
+        return turn, text
+
+    async def _submit_turn(self, text, speak, use_cache, turn=None):
+        # 选项不同的同一句话不能合并: 要求播报或跳过缓存的请求不能拿到别人的结果
+        key = f"{text} [speak={speak} cache={use_cache}]"
+        try:
+            result = await asyncio.wrap_future(self.turn_executor.submit(key, text, speak, use_cache, turn=turn))
+        except TurnCancelled as e:
+            status = HTTPStatus.CONFLICT if e.reason == "superseded" else HTTPStatus.SERVICE_UNAVAILABLE
+            return status, {"error": str(e), "reason": e.reason}
+        return HTTPStatus.OK, result
+
+    # HTTP --------------------------------------------------------------------
+
+    async def _route(self, method, path, body):
+        if method == "GET" and path == "/status":
+            return HTTPStatus.OK, self.status
+        if method == "GET" and path == "/metrics":
+            return HTTPStatus.OK, metrics.render_prometheus()
+        if method != "POST":
+            return HTTPStatus.NOT_FOUND, {"error": f"{method} {path} not found"}
+
+        try:
+            request = json.loads(body or b"{}")
+        except ValueError:
+            return HTTPStatus.BAD_REQUEST, {"error": "body is not JSON"}
+        if not isinstance(request, dict):
+            return HTTPStatus.BAD_REQUEST, {"error": "body must be a JSON object"}
+        loop = asyncio.get_running_loop()
+        if path == "/chat":
+            text = str(request.get("text", "")).strip()
+            if not text:
+                return HTTPStatus.BAD_REQUEST, {"error": "text is required"}
+            return await self._submit_turn(text, request.get("speak"), bool(request.get("cache", True)))
+        if path == "/actions":
+            actions = request.get("actions")
+            if not isinstance(actions, list) or not all(isinstance(action, str) for action in actions):
+                return HTTPStatus.BAD_REQUEST, {"error": "actions must be a list of strings"}
+            if not self.device_connected:
+                return HTTPStatus.SERVICE_UNAVAILABLE, {"error": "no device connected"}
+            results = await loop.run_in_executor(self.executor, self.send_actions, actions)
+            return HTTPStatus.OK, {"results": [{"command": r["command"], "ok": r["ok"], "latency": r["latency"]}
+                                               for r in results]}
+        if path == "/listen":
+            if not self.listener:
+                return HTTPStatus.SERVICE_UNAVAILABLE, {"error": "no microphone"}
+            turn, text = await loop.run_in_executor(self.executor, self.listen)
+            if not text:
+                return HTTPStatus.UNPROCESSABLE_ENTITY, {"error": "nothing was recognized"}
+            return await self._submit_turn(text, request.get("speak"), True, turn)
+        return HTTPStatus.NOT_FOUND, {"error": f"{method} {path} not found"}
+
+    @staticmethod
+    def _response(status, body, keep_alive=True):
+        if isinstance(body, str):
+            data, content_type = body.encode('utf-8'), "text/plain; version=0.0.4"
+        else:
+            data, content_type = json.dumps(body, ensure_ascii=False).encode('utf-8'), "application/json"
+        head = (f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(data)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        return head.encode('ascii') + data
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    return
+                lines = head.decode('latin-1').split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ", 2)
+                except ValueError:
+                    writer.write(self._response(HTTPStatus.BAD_REQUEST, {"error": "bad request line"}, False))
+                    return
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                path = target.split("?")[0]
+                self.requests += 1
+
+                if path == "/events" and headers.get("upgrade", "").lower() == "websocket":
+                    await self._websocket(reader, writer, headers)
+                    return
+
+                length = int(headers.get("content-length", 0) or 0)
+                if length > MAX_BODY:
+                    writer.write(self._response(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {"error": "body too large"}, False))
+                    return
+                body = await reader.readexactly(length) if length else b""
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                try:
+                    status, result = await self._route(method, path, body)
+                except Exception as e:
+                    error(e, f"{method} {path} Failed")
+                    status, result = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)}
+                writer.write(self._response(status, result, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def _websocket(self, reader, writer, headers):
+        key = headers.get("sec-websocket-key")
+        if not key:
+            writer.write(self._response(HTTPStatus.BAD_REQUEST, {"error": "Sec-WebSocket-Key is required"}, False))
+            return
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {websocket_accept(key)}\r\n\r\n").encode('ascii'))
+        await writer.drain()
+        queue = self.hub.subscribe()
+
+        async def send_events():
+            while True:
+                writer.write(encode_ws_frame(await queue.get()))
+                await writer.drain()
+
+        sender = asyncio.ensure_future(send_events())
+        try:
+            # 客户端只需要应答 ping 和关闭, 其他消息忽略
+            while True:
+                opcode, payload = await read_ws_frame(reader)
+                if opcode == WS_CLOSE:
+                    writer.write(encode_ws_frame(payload[:2], WS_CLOSE))
+                    await writer.drain()
+                    return
+                if opcode == WS_PING:
+                    writer.write(encode_ws_frame(payload, WS_PONG))
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            sender.cancel()
+            self.hub.unsubscribe(queue)
+
+    @property
+    def status(self):
+        return {
+            "serial": bool(self.ser and self.ser.connected),
+            "ble": bool(self.blt and self.blt.connected),
+            "speak": self.speak,
+            "connections": self.connections,
+            "requests": self.requests,
+            "event_clients": len(self.hub.clients) if self.hub else 0,
+            "events_published": self.hub.published if self.hub else 0,
+            "events_dropped": self.hub.dropped if self.hub else 0,
+            "turns": self.turn_executor.stats,
+        }
+
+    # 生命周期 ----------------------------------------------------------------
+
+    async def _start_server(self):
+        self.hub = EventHub(asyncio.get_running_loop())
+        self.server = await asyncio.start_server(self._handle, self.host, self.port, limit=MAX_HEADER)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info(f"Desk-Emoji daemon listening on http://{self.host}:{self.port}")
+
+    def start(self):
+        """Serve from a background thread, returns the port."""
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self._start_server())
+            started.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        started.wait()
+        return self.port
+
+    def stop(self):
+        if self.loop is None:
+            return
+
+        async def close():
+            self.server.close()
+            await self.server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=2)
+        self.turn_executor.shutdown()
+        self.executor.shutdown(wait=False)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from audio import Listener, Speaker
+    from connect import BluetoothClient, SerialClient
+    from gpt import GPT
+
+    parser = argparse.ArgumentParser(description=f"Desk-Emoji {VERSION} headless daemon")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--serial", metavar="PORT", help="serial port of the robot")
+    parser.add_argument("--ble", metavar="ADDRESS", help="BLE address of the robot, 'last' for the cached one")
+    parser.add_argument("--speak", action="store_true", help="play the answers on this machine's speaker")
+    parser.add_argument("--voice", default="onyx")
+    parser.add_argument("--workers", type=int, default=8, help="chat turns run at the same time")
+    parser.add_argument("--max-pending", type=int, default=64, help="queued chat turns before the oldest is dropped")
+    parser.add_argument("--supersede", action="store_true", help="a new instruction cancels the older ones")
+    args = parser.parse_args()
+
+    llm = GPT()
+    llm.connect()
+    ser = blt = None
+    if args.serial:
+        ser = SerialClient()
+        if not ser.connect(args.serial):
+            logger.warning(f"Serial port {args.serial} is not available")
+    if args.ble:
+        blt = BluetoothClient()
+        if not (blt.reconnect_last() if args.ble == "last" else blt.connect(args.ble)):
+            logger.warning(f"BLE device {args.ble} is not available")
+    daemon = Daemon(llm, ser=ser, blt=blt, speaker=Speaker(llm) if args.speak else None, listener=Listener(llm),
+                    host=args.host, port=args.port, workers=args.workers, voice=args.voice, speak=args.speak,
+                    max_pending=args.max_pending, supersede=args.supersede)
+    metrics.start_flush(os.path.join(log_directory, "metrics.json"))
+    daemon.start()
+    print(f"http://{args.host}:{daemon.port}", flush=True)
+    try:
+        daemon.thread.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.stop()
@@ -0,0 +1,242 @@
+import asyncio
+import threading
+import time
+
+from common import *
+from connect import (SerialClient, BaseBluetoothClient, BleakBackend, reply_ok,
+                     BLE_DEVICE_NAME, BLE_SERVICE_UUID, BLE_CHARACTERISTIC_UUID)
+from action import ActionCompiler, SendScheduler, TimingModel, expand_actions, host_delays
+from metrics import metrics
+
+
+class Device(object):
+    """One registered robot: its client, the groups it belongs to, its own timing model and
+    its send statistics."""
+
+    def __init__(self, name, kind, client, groups=()):
+        self.name = name
+        self.kind = kind  # "serial" 或 "ble"
+        self.client = client
+        self.groups = set(groups)
+        self.compiler = ActionCompiler()
+        self.timing = TimingModel()
+        self.lock = None  # asyncio.Lock, 在管理器的事件循环上创建
+        self.sent = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.last_latency = None
+        self.avg_latency = None
+        self.last_error = ""
+
+    @property
+    def connected(self):
+        return bool(self.client and self.client.connected)
+
+    def update(self, results, alpha=0.3):
+        latencies = [r["latency"] for r in results if r["latency"] is not None]
+        self.sent += len(results)
+        self.failed += sum(1 for r in results if not r["ok"])
+        self.timeouts += sum(1 for r in results if r["latency"] is None)
+        if latencies:
+            latency = sum(latencies) / len(latencies)
+            self.last_latency = latency
+            self.avg_latency = latency if self.avg_latency is None else \
+                alpha * latency + (1 - alpha) * self.avg_latency
+
+    @property
+    def stats(self):
+        return {
+            "kind": self.kind,
+            "groups": sorted(self.groups),
+            "connected": self.connected,
+            "sent": self.sent,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "avg_latency": round(self.avg_latency, 4) if self.avg_latency is not None else None,
+            "last_error": self.last_error,
+        }
+
+
+class DeviceManager(object):
+    """Registry of any number of serial and BLE robots. broadcast() compiles an actions list
+    for each target device and plays it on all of them concurrently from one event loop: a
+    slow or dead device only delays its own result, never the others. Lists broadcast before
+    the previous one finished wait for it, each device plays them one at a time in order."""
+
+    def __init__(self, window=2, ack_timeout=5.0, device_timeout=30.0, lead=0.05, backend=BleakBackend):
+        self.window = window
+        self.ack_timeout = ack_timeout
+        self.lead = lead
+        self.device_timeout = device_timeout
+        self.backend = backend
+        self.devices = {}
+        self.lock = threading.Lock()
+        self.last_report = {}
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self._run_event_loop, daemon=True)
+        self.loop_thread.start()
+
+    def _run_event_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def _register(self, device):
+        with self.lock:
+            if device.name in self.devices:
+                raise ValueError(f"Device {device.name} is already registered")
+            self.devices[device.name] = device
+        logger.info(f"Registered {device.kind} device {device.name}, groups {sorted(device.groups)}")
+        return device
+
+    def add_serial(self, port, name=None, groups=(), client=None):
+        """Connect a serial robot (or register an already connected SerialClient)."""
+        if client is None:
+            client = SerialClient()
+            if not client.connect(port):
+                return None
+        return self._register(Device(name or port, "serial", client, groups))
+
+    def add_ble(self, address, name=None, groups=()):
+        """Connect a BLE robot on the manager's event loop, so that all BLE traffic shares it."""
+        client = BaseBluetoothClient(BLE_DEVICE_NAME, BLE_SERVICE_UUID, BLE_CHARACTERISTIC_UUID,
+                                     BLE_CHARACTERISTIC_UUID, self.backend)
+        if not self._run(client.connect(address)):
+            return None
+        return self._register(Device(name or address, "ble", client, groups))
+
+    def remove(self, name):
+        with self.lock:
+            device = self.devices.pop(name, None)
+        if device is None:
+            return
+        if device.kind == "ble":
+            self._run(device.client.disconnect())
+        else:
+            device.client.disconnect()
+
+    def close(self):
+        for name in list(self.devices):
+            self.remove(name)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def targets(self, group=None):
+        with self.lock:
+            return [device for device in self.devices.values()
+                    if device.connected and (group is None or group in device.groups)]
+
+    def __len__(self):
+        return len(self.devices)
+
+    def broadcast(self, actions, group=None, wait=True):
+        """Play actions on every connected device (of group), returns per-device reports, or
+        a concurrent Future of them when wait is False."""
+        future = asyncio.run_coroutine_threadsafe(self.broadcast_async(actions, group), self.loop)
+        return future.result() if wait else future
+
+    async def broadcast_async(self, actions, group=None):
+        start_time = time.time()
+        devices = self.targets(group)
+        reports = await asyncio.gather(*(self._play_device(device, actions) for device in devices))
+        elapsed = time.time() - start_time
+        slowest = max(reports, key=lambda r: r["total"], default=None)
+        self.last_report = {
+            "devices": len(devices),
+            "failed_devices": sum(1 for r in reports if not r["ok"]),
+            "total": elapsed,
+            "slowest": slowest["device"] if slowest else None,
+            "results": reports,
+        }
+        metrics.observe("fanout_seconds", elapsed)
+        logger.info("Broadcast to {devices} devices in {total:.2f} s, {failed_devices} failed".format(**self.last_report))
+        return reports
+
+    async def _play_device(self, device, actions):
+        if device.lock is None:
+            device.lock = asyncio.Lock()
+        # 流式回答会连续广播多段动作, 同一台设备上按顺序逐段执行
+        async with device.lock:
+            return await self._play_device_locked(device, actions)
+
+    async def _play_device_locked(self, device, actions):
+        start_time = time.time()
+        position = device.compiler.position
+        commands = device.compiler.compile(actions)
+        results = []
+        try:
+            if device.kind == "ble":
+                play = device.client.send_commands(commands, host_delays, device.timing, position)
+            else:
+                play = self._play_serial(device, commands, results, position)
+            results = await asyncio.wait_for(play, timeout=self.device_timeout) or results
+            device.last_error = ""
+        except asyncio.TimeoutError:
+            device.last_error = f"timeout after {self.device_timeout:.0f} s"
+        except Exception as e:
+            device.last_error = str(e)
+            logger.error(f"Send to {device.name} failed: {e}")
+        device.update(results)
+        failed = sum(1 for r in results if not r["ok"])
+        if failed or device.last_error:
+            metrics.inc("send_failures_total", failed or 1, transport=device.kind)
+        for r in results:
+            if r["latency"] is not None:
+                metrics.observe("command_seconds", r["latency"], transport=device.kind)
+        return {
+            "device": device.name,
+            "ok": not failed and not device.last_error,
+            "commands": len(results),
+            "failed": failed,
+            "total": time.time() - start_time,
+            "avg_latency": device.last_latency if results else None,
+            "error": device.last_error,
+        }
+
+    async def _play_serial(self, device, commands, results, position=None):
+        """Async driver of the SendScheduler that ActionPipeline.run drives with threads:
+        the acks come from the serial read thread, and the device's timing model is
+        calibrated from them."""
+        client = device.client
+        scheduler = SendScheduler(self.window, self.ack_timeout, device.timing, self.lead, position)
+        acks = {}  # 串口客户端的 Future -> 包装后的 asyncio Future, 每个只包装一次
+
+        async def wait_ack(entry):
+            command, sent_at, future, deadline, _ = entry
+            try:
+                reply, received_at = await asyncio.wait_for(acks.pop(future), timeout=max(deadline - time.time(), 0))
+                results.append(SendScheduler.result(entry, reply, received_at))
+            except asyncio.TimeoutError:
+                client.cancel(future)
+                results.append(SendScheduler.result(entry))
+                logger.warning(f"No ack for '{command}' from {device.name} after {deadline - sent_at:.1f} s")
+            except Exception as e:
+                # 串口断开时未确认的命令都以异常结束
+                results.append(SendScheduler.result(entry))
+                logger.warning(f"'{command}' failed on {device.name}: {e}")
+
+        try:
+            for step, arg in scheduler.steps(expand_actions(commands)):
+                if step == "ack":
+                    await wait_ack(scheduler.pending.popleft())
+                elif step == "sleep":
+                    await asyncio.sleep(arg)
+                elif step == "idle":
+                    await asyncio.wait([acks[scheduler.pending[-1][2]]], timeout=arg)
+                else:
+                    sent_at = time.time()
+                    future = client.send_command(arg)
+                    acks[future] = asyncio.wrap_future(future)
+                    scheduler.sent(arg, future, sent_at)
+        finally:
+            for future, ack in acks.items():
+                ack.cancel()
+                client.cancel(future)
+        scheduler.calibrate(results)
+        return results
+
+    @property
+    def stats(self):
+        with self.lock:
+            return {name: device.stats for name, device in self.devices.items()}
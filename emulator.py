@@ -0,0 +1,208 @@
+import os
+import select
+import struct
+import threading
+import time
+
+from common import *
+from connect import BinaryProtocol
+from action import CENTER, TimingModel
+
+# board.ino 中的常量
+FRAME_MAX = 16
+STREAM_TIMEOUT = 1.0  # Serial.readStringUntil / readBytes 的默认超时 (秒)
+BOOT_MESSAGES = ["Initializing...", "Hello, I am Desk-Emoji. Nice to meet you :)"]
+BOOT_TIME = 2.5
+
+# loop() 中能识别的文本命令, head_move 带参数单独处理
+text_commands = ["eye_blink", "eye_happy", "eye_sad", "eye_anger", "eye_surprise", "eye_right", "eye_left",
+                 "head_center", "head_nod", "head_shake", "head_roll"]
+
+
+class FirmwareEmulator(object):
+    """Emulate the serial protocol of board/board.ino's loop() on a pseudo-terminal, so that
+    SerialClient can open it like a real port: text commands are echoed after they finish
+    (prefixed with 'Unknown command: ' when not recognized), 'proto' is answered with the
+    protocol version, and binary frames get ACK frames. Each command takes the time the
+    host TimingModel predicts for it, multiplied by time_scale (0 runs everything at once)."""
+
+    def __init__(self, time_scale=1.0, binary=True, boot=False, timing=None):
+        self.time_scale = time_scale
+        self.binary = binary
+        self.boot = boot
+        self.timing = timing or TimingModel()
+        self.protocol = BinaryProtocol()
+        self.op_names = {op: name for name, op in self.protocol.opcodes.items()}
+        self.position = CENTER
+        self.master = None
+        self.slave = None
+        self.port = None
+        self.running = False
+        self.thread = None
+        self.commands = 0
+        self.unknown = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def start(self):
+        """Open the pseudo-terminal and start the firmware loop, returns the port name."""
+        import pty
+        import tty
+
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self.port
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=2)
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self.master = self.slave = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _write(self, data):
+        self.bytes_out += len(data)
+        os.write(self.master, data)
+
+    def _println(self, text):
+        self._write(f"{text}\r\n".encode('utf-8'))
+
+    def _read(self, buffer, timeout):
+        readable, _, _ = select.select([self.master], [], [], timeout)
+        if not readable:
+            return buffer, False
+        try:
+            data = os.read(self.master, 4096)
+        except OSError:
+            return buffer, False
+        self.bytes_in += len(data)
+        return buffer + data, True
+
+    def _run(self):
+        if self.boot:
+            self._println(BOOT_MESSAGES[0])
+            # 复位时间不随 time_scale 缩放, 主机端的协议协商要按真实的启动时间测试
+            time.sleep(BOOT_TIME)
+            self._println(BOOT_MESSAGES[1])
+        buffer = b''
+        last_data = time.time()
+        while self.running:
+            buffer, received = self._read(buffer, 0.1)
+            if received:
+                last_data = time.time()
+            while buffer and self.running:
+                if self.binary and buffer[0] == BinaryProtocol.SYNC:
+                    consumed = self._handle_frame(buffer)
+                    if not consumed:
+                        break
+                    buffer = buffer[consumed:]
+                    continue
+                index = buffer.find(b'\n')
+                if index < 0:
+                    # readStringUntil 超时后按已收到的内容处理
+                    if time.time() - last_data < STREAM_TIMEOUT:
+                        break
+                    index = len(buffer)
+                line, buffer = buffer[:index], buffer[index + 1:]
+                self._handle_line(line.decode('utf-8', errors='ignore').strip())
+
+    def _handle_line(self, cmd):
+        if cmd == "proto" and self.binary:
+            # 旧固件没有这个分支, 按未知命令回显
+            self._println(f"proto {BinaryProtocol.VERSION}")
+            return
+        if cmd in text_commands:
+            self._execute(cmd)
+        elif cmd.startswith("head_move"):
+            # 与固件一致: 少于三个参数时什么也不做, 但仍然回显
+            if len(cmd.split(" ")) >= 4:
+                self._execute(cmd)
+        else:
+            self.unknown += 1
+            self._write(b"Unknown command: ")
+        self._println(cmd)
+        self._sleep(10)
+
+    def _handle_frame(self, buffer):
+        """Process one frame at the start of buffer, returns the bytes consumed (0 = incomplete)."""
+        if len(buffer) < 2:
+            return 0
+        length = buffer[1]
+        if length < 2 or length + 2 > FRAME_MAX:
+            return 2
+        if len(buffer) < length + 3:
+            return 0
+        frame = bytes(buffer[1:length + 3])
+        op, seq = frame[1], frame[2]
+        if self.protocol.crc8(frame[:length + 1]) != frame[length + 1]:
+            self._ack(seq, BinaryProtocol.STATUS_BAD_CRC)
+            return length + 3
+        name = self.op_names.get(op)
+        fmt = self.protocol.arg_formats.get(op, "<")
+        if name is None or struct.calcsize(fmt) != length - 2:
+            self.unknown += 1
+            self._ack(seq, BinaryProtocol.STATUS_UNKNOWN)
+            return length + 3
+        args = struct.unpack(fmt, frame[3:length + 1])
+        self._execute(" ".join([name] + [str(arg) for arg in args]))
+        self._ack(seq, BinaryProtocol.STATUS_OK)
+        self._sleep(10)
+        return length + 3
+
+    def _ack(self, seq, status):
+        self._write(self.protocol.encode_frame(BinaryProtocol.OP_ACK, seq, [status]))
+
+    def _execute(self, command):
+        self.commands += 1
+        ms, self.position = self.timing.base_ms(command, self.position)
+        self._sleep(ms)
+
+    def _sleep(self, ms):
+        if self.time_scale > 0:
+            time.sleep(ms / 1000 * self.time_scale)
+
+    @property
+    def stats(self):
+        return {
+            "commands": self.commands,
+            "unknown": self.unknown,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Desk-Emoji firmware emulator on a pseudo-terminal")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="multiplier of the real command times, 0 for instant")
+    parser.add_argument("--text-only", action="store_true", help="emulate old firmware without binary frames")
+    parser.add_argument("--boot", action="store_true", help="print the boot messages and take the setup() time first")
+    args = parser.parse_args()
+
+    emulator = FirmwareEmulator(time_scale=args.time_scale, binary=not args.text_only, boot=args.boot)
+    print(emulator.start(), flush=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.stop()
+        logger.info(f"Emulator stats: {emulator.stats}")
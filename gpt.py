@@ -1,20 +1,232 @@
-from openai import OpenAI
-import requests
+import importlib.util
+import threading
 import json
+import time
+import re
 import os
 
 from common import *
-from connect import *
+from cache import AudioCache, ResponseCache, SemanticCache
+from intent import IntentMatcher
+from metrics import metrics
+from prompt import DEFAULT_PROMPT_LEVEL, PROMPT_LEVELS, build_system_prompt, count_tokens, system_prompt_tokens
 
 
-class GPT(BaseLLM):
+# httpx 只有在安装了 h2 时才能启用 HTTP/2
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class HTTPSession(object):
+    """Long-lived pooled HTTP client shared by every API call of a GPT instance."""
+
+    def __init__(self, max_connections=10, keepalive_expiry=120, http2=HTTP2_AVAILABLE):
+        # httpx 导入耗时较长, 推迟到创建会话时
+        import httpx
+
+        self.http2 = http2
+        self.client = httpx.Client(
+            http2=http2,
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_connections,
+                                keepalive_expiry=keepalive_expiry),
+            timeout=httpx.Timeout(30, connect=10),
+        )
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+
+    def _trace(self, event_name, info):
+        # httpcore 只在新建 TCP 连接时触发 connect_tcp 事件, 没有该事件即为复用
+        if event_name == "connection.connect_tcp.complete":
+            with self.lock:
+                self.new_connections += 1
+            metrics.inc("http_connections_total")
+
+    def _count(self):
+        with self.lock:
+            self.requests += 1
+        metrics.inc("http_requests_total")
+
+    def request(self, method, url, **kwargs):
+        self._count()
+        extensions = kwargs.pop("extensions", {})
+        extensions["trace"] = self._trace
+        return self.client.request(method, url, extensions=extensions, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def stream(self, method, url, **kwargs):
+        self._count()
+        extensions = kwargs.pop("extensions", {})
+        extensions["trace"] = self._trace
+        return self.client.stream(method, url, extensions=extensions, **kwargs)
+
+    def warm_up(self, url, background=True):
+        """Open (and keep alive) a connection to the origin of url ahead of the first real request."""
+        if not url:
+            return None
+
+        def _warm():
+            import httpx
+            try:
+                origin = httpx.URL(url).copy_with(path="/", query=None, fragment=None)
+                start_time = time.time()
+                self.request("HEAD", origin, timeout=10)
+                logger.info(f"Warmed up connection to {origin.host} in {(time.time() - start_time) * 1000:.0f} ms")
+            except Exception as e:
+                logger.warning(f"Warm up connection to {url} failed: {e}")
+
+        if not background:
+            _warm()
+            return None
+        thread = threading.Thread(target=_warm, daemon=True)
+        thread.start()
+        return thread
+
+    @property
+    def stats(self):
+        with self.lock:
+            return {
+                "http2": self.http2,
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                "reused_connections": max(self.requests - self.new_connections, 0),
+            }
+
+    def close(self):
+        self.client.close()
+
+
+class ResponseStreamParser(object):
+    """Incrementally extracts the "answer" text and "actions" strings from a JSON reply
+    that arrives in arbitrary chunks. Tolerant of ```json fences and leading text."""
+
+    ANSWER_RE = re.compile(r'"answer"\s*:\s*"')
+    ACTIONS_RE = re.compile(r'"actions"\s*:\s*\[')
+    ACTION_RE = re.compile(r'\s*,?\s*"((?:[^"\\]|\\.)*)"')
+    ACTIONS_END_RE = re.compile(r'\s*,?\s*\]')
 
     def __init__(self):
+        self.buffer = ""
+        self.answer = ""
+        self.actions = []
+        self._answer_pos = None
+        self._answer_done = False
+        self._actions_pos = None
+        self._actions_done = False
+
+    def feed(self, text):
+        """Append text, return (answer_delta, new_actions)."""
+        self.buffer += text
+        return self._parse_answer(), self._parse_actions()
+
+    def _parse_answer(self):
+        if self._answer_done:
+            return ""
+        if self._answer_pos is None:
+            match = self.ANSWER_RE.search(self.buffer)
+            if not match:
+                return ""
+            self._answer_pos = match.end()
+
+        i = end = self._answer_pos
+        while i < len(self.buffer):
+            char = self.buffer[i]
+            if char == '"':
+                self._answer_done = True
+                break
+            if char == '\\':
+                # 转义序列不完整时等待下一个分片
+                i += 6 if self.buffer[i + 1:i + 2] == 'u' else 2
+                if i > len(self.buffer):
+                    break
+            else:
+                i += 1
+            end = i
+
+        try:
+            answer = json.loads(f'"{self.buffer[self._answer_pos:end]}"')
+        except ValueError:
+            return ""
+        delta = answer[len(self.answer):]
+        self.answer = answer
+        return delta
+
+    def _parse_actions(self):
+        if self._actions_done:
+            return []
+        if self._actions_pos is None:
+            match = self.ACTIONS_RE.search(self.buffer)
+            if not match:
+                return []
+            self._actions_pos = match.end()
+
+        actions = []
+        while True:
+            match = self.ACTION_RE.match(self.buffer, self._actions_pos)
+            if not match:
+                break
+            try:
+                actions.append(json.loads(f'"{match.group(1)}"'))
+            except ValueError:
+                pass
+            self._actions_pos = match.end()
+        if self.ACTIONS_END_RE.match(self.buffer, self._actions_pos):
+            self._actions_done = True
+        self.actions.extend(actions)
+        return actions
+
+
+def parse_response(response):
+    """Return (answer, actions) from the JSON string produced by GPT.chat or GPT.chat_stream."""
+    try:
+        parsed = json.loads(response)
+    except (TypeError, ValueError):
+        return response, []
+    if not isinstance(parsed, dict):
+        return response, []
+    answer = parsed.get("answer", response)
+    actions = parsed.get("actions")
+    if actions is None and isinstance(answer, str):
+        # chat() 的 answer 是模型原始输出, 其中嵌套着 {"answer": ..., "actions": [...]}
+        parser = ResponseStreamParser()
+        parser.feed(answer)
+        if parser.answer or parser.actions:
+            return parser.answer, parser.actions
+    return answer, actions or []
+
+
+audio_mime_types = {
+    "wav": "audio/wav",
+    "flac": "audio/flac",
+    "mp3": "audio/mpeg",
+    "ogg": "audio/ogg",
+}
+
+
+class GPT(BaseLLM):
+
+    def __init__(self, warm_up=True):
         super().__init__("GPT")
         self.json_path = 'gpt_api.json'
         self.provider = "siliconflow"  # 默认使用硅基流动
         self.is_proxy_api = True  # 默认设为中转API
+        self.model = ""
+        self.prompt_level = DEFAULT_PROMPT_LEVEL
+        self.session = HTTPSession()
+        self.cache = ResponseCache(path=os.path.join('cache', 'responses.json'))
+        # 去掉礼貌用语后相同的指令 ("请给我讲个笑话" / "给我讲个笑话") 由语义缓存命中,
+        # 阈值按 `benchmark.py semantic` 的中英文改写数据标定, 设为 False 可以关闭
+        self.semantic_cache = SemanticCache(path=os.path.join('cache', 'semantic.json'))
+        self.use_semantic_cache = True
+        self.audio_cache = AudioCache(os.path.join('cache', 'tts'))
+        # 简单的动作指令在本地直接回答, 不请求 LLM
+        self.intents = IntentMatcher(path='intents.json')
         self._create_empty_json()
+        if warm_up:
+            # 启动时在后台预热连接, 首次对话无需再等待 DNS/TCP/TLS 握手
+            self.session.warm_up(self.read_json()[0])
 
     def _create_empty_json(self):
         if not os.path.exists(self.json_path):
@@ -27,9 +239,10 @@ class GPT(BaseLLM):
                     "model": "Qwen/QwQ-32B"
                 }, f)
 
-    def write_json(self, api_url, api_key, model="", provider="openai"):
+    def write_json(self, api_url, api_key, model="", provider="openai", prompt_level=""):
         with open(self.json_path, 'w') as f:
-            json.dump({"api_url": api_url, "api_key": api_key, "provider": provider, "model": model}, f)
+            json.dump({"api_url": api_url, "api_key": api_key, "provider": provider, "model": model,
+                       "prompt_level": prompt_level or self.prompt_level}, f)
 
     def read_json(self):
         try:
@@ -37,6 +250,13 @@ class GPT(BaseLLM):
                 data = json.load(f)
                 self.provider = data.get("provider", "openai")
                 self.model = data.get("model", "")
+                prompt_level = data.get("prompt_level", self.prompt_level)
+                if prompt_level not in PROMPT_LEVELS:
+                    # 配置写错时退回默认级别, 否则每次对话都会在生成 prompt 时出错
+                    logger.warning(f"Unknown prompt_level '{prompt_level}' in {self.json_path}, "
+                                   f"using '{DEFAULT_PROMPT_LEVEL}'")
+                    prompt_level = DEFAULT_PROMPT_LEVEL
+                self.prompt_level = prompt_level
                 return data.get("api_url", ""), data.get("api_key", "")
         except Exception as e:
             error(e, f"Failed to read {self.json_path}")
@@ -66,7 +286,7 @@ class GPT(BaseLLM):
             }
             
             logger.info(f"Testing connection to: {self.api_url}")
-            response = requests.post(
+            response = self.session.post(
                 self.api_url,
                 headers=headers,
                 json=payload,
@@ -76,6 +296,7 @@ class GPT(BaseLLM):
             if response.status_code == 200:
                 result = response.json()
                 logger.info(f"Connect to Silicon Flow API Success! Response: {result}")
+                logger.info(f"HTTP session stats: {self.session.stats}")
                 return True
             else:
                 error_msg = f"HTTP {response.status_code}: {response.text}"
@@ -85,14 +306,15 @@ class GPT(BaseLLM):
             error(e, "Connect to API Failed! Please check the API configuration")
             return False
 
-    def chat(self, message='', model="", temperature=0.7):
+    def _chat_request(self, message, model, temperature, stream):
         if not model and hasattr(self, 'model') and self.model:
             model = self.model
         if not model:  # 如果还是没有模型，使用默认值
             model = "Qwen/QwQ-32B"
         
-        messages = [{"role": "system", "content": llm_role},
-                    {"role": "user", "content": llm_prompt + message}]
+        # 静态部分全部放在 system 角色, 每轮前缀相同, 支持前缀缓存的服务商可以直接复用
+        messages = [{"role": "system", "content": self.system_prompt},
+                    {"role": "user", "content": message}]
         
         # 使用直接的 HTTP 请求
         headers = {
@@ -109,13 +331,82 @@ class GPT(BaseLLM):
             "frequency_penalty": 0.5,
             "n": 1,
             "response_format": {"type": "text"},
-            "stream": False
+            "stream": stream
         }
-        
-        logger.info(f"Sending request to {self.api_url} with model {model}")
+        return model, headers, payload
+
+    @property
+    def system_prompt(self):
+        return build_system_prompt(self.prompt_level)
+
+    def prompt_tokens(self):
+        return system_prompt_tokens(self.prompt_level)
+
+    def _cache_key(self, model, temperature, message):
+        return self.cache.make_key(model, temperature, message, self.system_prompt)
+
+    def _cache_lookup(self, cache_key, use_cache):
+        if not use_cache:
+            return None
+        cached = self.cache.get(cache_key)
+        metrics.inc("cache_lookups_total", cache="response", result="miss" if cached is None else "hit")
+        if cached is not None:
+            logger.info(f"Response cache hit: {self.cache.stats}")
+        return cached
+
+    def _semantic_scope(self, model, temperature):
+        return self.cache.make_key(model, temperature, "", self.system_prompt)
+
+    def _semantic_lookup(self, message, scope, use_cache):
+        if not use_cache or not self.use_semantic_cache:
+            return None
+
+        def same_actions(matched):
+            # 字面相近但动作词不同的指令 (向左看 / 向右看) 不能共用回答
+            if self.intents is None:
+                return True
+            return set(self.intents.match(message)[0]) == set(self.intents.match(matched)[0])
+
+        hit = self.semantic_cache.get(message, scope, accept=same_actions)
+        metrics.inc("cache_lookups_total", cache="semantic", result="miss" if hit is None else "hit")
+        if hit is None:
+            return None
+        value, matched, similarity = hit
+        logger.info(f"Semantic cache hit ({similarity:.2f}): {message} ~ {matched}, {self.semantic_cache.stats}")
+        return value
+
+    def _semantic_store(self, message, scope, response):
+        if not self.use_semantic_cache:
+            return
+        answer, actions = parse_response(response)
+        self.semantic_cache.put(message, json.dumps({"answer": answer, "actions": actions}, ensure_ascii=False), scope)
+
+    def _intent_lookup(self, message, use_intents):
+        if not use_intents or self.intents is None:
+            return None
+        response = self.intents.respond(message)
+        metrics.inc("cache_lookups_total", cache="intent", result="miss" if response is None else "hit")
+        return response
+
+    def chat(self, message='', model="", temperature=0.7, use_cache=True, use_intents=True):
+        local = self._intent_lookup(message, use_intents)
+        if local is not None:
+            return local
+        model, headers, payload = self._chat_request(message, model, temperature, stream=False)
+        cache_key = self._cache_key(model, temperature, message)
+        scope = self._semantic_scope(model, temperature)
+        cached = self._cache_lookup(cache_key, use_cache) or self._semantic_lookup(message, scope, use_cache)
+        if cached is not None:
+            return cached
+        with metrics.span("llm"):
+            return self._post_chat(message, model, headers, payload, cache_key, scope, use_cache)
+
+    def _post_chat(self, message, model, headers, payload, cache_key, scope, use_cache):
+        logger.info(f"Sending request to {self.api_url} with model {model}, "
+                    f"prompt level {self.prompt_level} ({self.prompt_tokens()} tokens)")
         
         try:
-            response = requests.post(
+            response = self.session.post(
                 self.api_url,
                 headers=headers,
                 json=payload,
@@ -124,33 +415,147 @@ class GPT(BaseLLM):
             
             if response.status_code == 200:
                 result = response.json()
-                logger.debug(f"Raw API response: {result}")
+                # 参数延迟到日志线程再格式化, 不占用对话线程的时间
+                logger.debug("Raw API response: %s", result)
+                logger.debug("HTTP session stats: %s", self.session.stats)
+                self._count_tokens(result.get("usage"))
                 
+                cacheable = False
                 if "choices" in result and len(result["choices"]) > 0 and "message" in result["choices"][0]:
                     answer_text = result["choices"][0]["message"].get("content", "").strip()
                     if not answer_text:
                         answer_text = "API返回了空响应，请检查模型配置或重试。"
                         logger.warning("Received empty response content from API")
+                    else:
+                        cacheable = True
                 else:
                     answer_text = f"API返回了非标准格式: {result}"
                     logger.warning(f"Unexpected API response format: {result}")
                 
-                return json.dumps({"answer": answer_text})
+                answer = json.dumps({"answer": answer_text})
+                if cacheable and use_cache:
+                    self.cache.put(cache_key, answer)
+                    self._semantic_store(message, scope, answer)
+                return answer
             else:
                 error_msg = f"API请求失败: {response.status_code} - {response.text}"
                 logger.error(error_msg)
+                metrics.inc("llm_errors_total", status=response.status_code)
                 return json.dumps({"answer": error_msg})
         except Exception as e:
             error_msg = f"请求错误: {str(e)}"
             logger.error(error_msg)
+            metrics.inc("llm_errors_total", status="exception")
             return json.dumps({"answer": error_msg})
 
-    def speech(self, model="whisper-1", audio_path=""):
+    def _count_tokens(self, usage, completion_text=None):
+        if usage:
+            metrics.inc("llm_tokens_total", usage.get("prompt_tokens", 0), kind="prompt")
+            metrics.inc("llm_tokens_total", usage.get("completion_tokens", 0), kind="completion")
+        elif completion_text:
+            # 流式响应通常不带 usage, 按文本估算
+            metrics.inc("llm_tokens_total", count_tokens(completion_text), kind="completion")
+
+    def chat_stream(self, message='', model="", temperature=0.7, on_answer=None, on_action=None, use_cache=True,
+                    use_intents=True):
+        """Stream a chat completion, calling on_answer(delta) as the answer grows and
+        on_action(action) as soon as each action string is closed."""
+        model, headers, payload = self._chat_request(message, model, temperature, stream=True)
+        cache_key = self._cache_key(model, temperature, message)
+        scope = self._semantic_scope(model, temperature)
+        cached = (self._intent_lookup(message, use_intents) or self._cache_lookup(cache_key, use_cache)
+                  or self._semantic_lookup(message, scope, use_cache))
+        if cached is not None:
+            answer, actions = parse_response(cached)
+            if answer and on_answer:
+                on_answer(answer)
+            for action in actions:
+                if on_action:
+                    on_action(action)
+            return cached
+        with metrics.span("llm"):
+            return self._stream_chat(message, model, headers, payload, cache_key, scope, use_cache, on_answer, on_action)
+
+    def _stream_chat(self, message, model, headers, payload, cache_key, scope, use_cache, on_answer, on_action):
+        parser = ResponseStreamParser()
+        start_time = time.time()
+        first_action_time = None
+
+        def _feed(text):
+            nonlocal first_action_time
+            answer_delta, actions = parser.feed(text)
+            if answer_delta and on_answer:
+                on_answer(answer_delta)
+            for action in actions:
+                if first_action_time is None:
+                    first_action_time = time.time()
+                    metrics.record("first_action", first_action_time - start_time)
+                    logger.info(f"First action after {(first_action_time - start_time) * 1000:.0f} ms: {action}")
+                if on_action:
+                    on_action(action)
+
+        logger.info(f"Streaming request to {self.api_url} with model {model}")
+
+        try:
+            with self.session.stream("POST", self.api_url, headers=headers, json=payload, timeout=30) as response:
+                if response.status_code != 200:
+                    response.read()
+                    error_msg = f"API请求失败: {response.status_code} - {response.text}"
+                    logger.error(error_msg)
+                    metrics.inc("llm_errors_total", status=response.status_code)
+                    return json.dumps({"answer": error_msg})
+
+                if "text/event-stream" not in response.headers.get("content-type", ""):
+                    # 服务端忽略了 stream 参数, 按普通响应一次性解析
+                    response.read()
+                    result = response.json()
+                    _feed(result["choices"][0]["message"].get("content", ""))
+                else:
+                    for line in response.iter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[len("data:"):].strip()
+                        if data == "[DONE]":
+                            # 继续读到响应结束, 连接才能放回连接池复用
+                            continue
+                        chunk = json.loads(data)
+                        if not chunk.get("choices"):
+                            continue
+                        delta = chunk["choices"][0].get("delta", {}).get("content")
+                        if delta:
+                            _feed(delta)
+
+            logger.info(f"Stream finished in {(time.time() - start_time) * 1000:.0f} ms, "
+                        f"{len(parser.actions)} actions")
+            logger.debug("Raw stream content: %s", parser.buffer)
+            self._count_tokens(None, parser.buffer)
+            if not parser.answer and not parser.actions:
+                return json.dumps({"answer": parser.buffer.strip() or "API返回了空响应，请检查模型配置或重试。"})
+            answer = json.dumps({"answer": parser.answer, "actions": parser.actions})
+            if use_cache:
+                self.cache.put(cache_key, answer)
+                self._semantic_store(message, scope, answer)
+            return answer
+        except Exception as e:
+            error_msg = f"请求错误: {str(e)}"
+            logger.error(error_msg)
+            metrics.inc("llm_errors_total", status="exception")
+            return json.dumps({"answer": error_msg})
+
+    def speech(self, model="whisper-1", audio_path="", audio_bytes=None, filename="input.wav"):
+        """Transcribe audio_bytes (uploaded as filename, whose extension tells the format)
+        or the file at audio_path."""
+        if audio_bytes is None:
+            with open(audio_path, "rb") as audio_file:
+                audio_bytes = audio_file.read()
+            filename = os.path.basename(audio_path)
+        mime_type = audio_mime_types.get(os.path.splitext(filename)[1].lstrip('.'), "application/octet-stream")
+        logger.info(f"Uploading {len(audio_bytes)} bytes of {mime_type} for transcription")
+
         if self.provider == "openai":
-            audio_file= open(audio_path, "rb")
             transcription = self.client.audio.transcriptions.create(
                 model=model,
-                file=audio_file
+                file=(filename, audio_bytes, mime_type)
             )
             return transcription.text
         elif self.provider == "deepseek":
@@ -159,14 +564,13 @@ class GPT(BaseLLM):
             headers = {
                 "Authorization": f"Bearer {self.api_key}"
             }
-            with open(audio_path, "rb") as audio_file:
-                files = {"file": audio_file}
-                response = requests.post(
-                    f"{self.api_url.split('/chat/completions')[0]}/audio/transcriptions",
-                    headers=headers,
-                    files=files,
-                    data={"model": model}
-                )
+            files = {"file": (filename, audio_bytes, mime_type)}
+            response = self.session.post(
+                f"{self.api_url.split('/chat/completions')[0]}/audio/transcriptions",
+                headers=headers,
+                files=files,
+                data={"model": model}
+            )
             if response.status_code == 200:
                 return response.json().get("text", "")
             else:
@@ -178,15 +582,31 @@ class GPT(BaseLLM):
             logger.error(error_msg)
             return ""
 
-    def speak(self, text="", model="tts-1", voice="onyx", audio_path=""):
+    def synthesize(self, text="", model="tts-1", voice="onyx", response_format="mp3", use_cache=True):
+        """Return the synthesized audio of text as bytes, or None on failure."""
+        cache_key = self.audio_cache.make_key(self.provider, model, voice, text, response_format)
+        audio = self.audio_cache.get(cache_key) if use_cache else None
+        if use_cache:
+            metrics.inc("cache_lookups_total", cache="audio", result="miss" if audio is None else "hit")
+        if audio is not None:
+            logger.debug(f"Audio cache hit for '{text}'")
+            return audio
+        with metrics.span("tts"):
+            audio = self._synthesize(text, model, voice, response_format)
+        if audio and use_cache:
+            self.audio_cache.put(cache_key, audio)
+        return audio
+
+    def _synthesize(self, text, model, voice, response_format):
         if self.provider == "openai":
             response = self.client.audio.speech.create(
                 model=model,
                 voice=voice,
-                input=text
+                input=text,
+                response_format=response_format
             )
             logger.info(f"Voice: {voice}")
-            response.stream_to_file(audio_path)
+            return response.content
         elif self.provider == "deepseek":
             # DeepSeek 可能有不同的语音合成 API，这里需要根据 DeepSeek 的 API 文档进行调整
             # 以下是示例代码，需要根据实际 API 进行修改
@@ -197,26 +617,33 @@ class GPT(BaseLLM):
             payload = {
                 "model": model,
                 "voice": voice,
-                "input": text
+                "input": text,
+                "response_format": response_format
             }
-            response = requests.post(
+            response = self.session.post(
                 f"{self.api_url.split('/chat/completions')[0]}/audio/speech",
                 headers=headers,
                 json=payload
             )
             if response.status_code == 200:
-                with open(audio_path, "wb") as f:
-                    f.write(response.content)
                 logger.info(f"Voice: {voice}")
+                return response.content
             else:
                 error_msg = f"DeepSeek TTS API Error: {response.status_code} - {response.text}"
                 logger.error(error_msg)
         else:
             error_msg = f"TTS not supported for provider: {self.provider}"
             logger.error(error_msg)
+        return None
 
+    def speak(self, text="", model="tts-1", voice="onyx", audio_path=""):
+        audio = self.synthesize(text=text, model=model, voice=voice)
+        if audio:
+            with open(audio_path, "wb") as f:
+                f.write(audio)
 
 if __name__ == '__main__':
+    from connect import BluetoothClient
     blt = BluetoothClient()
     llm = GPT()
     llm.connect()
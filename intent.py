@@ -0,0 +1,151 @@
+import re
+import json
+import threading
+from collections import Counter
+
+from common import *
+
+
+# 除按钮文字外的常见说法, 可以在 intents.json 中用同样的格式补充: {"head_nod": ["点点头", ...]}
+synonyms = {
+    "eye_blink": ["眨眨眼", "眨一下眼", "blink", "wink"],
+    "eye_happy": ["开心", "高兴", "笑一个", "笑一笑", "笑", "happy", "smile", "be happy"],
+    "eye_sad": ["伤心", "不开心", "sad", "be sad"],
+    "eye_anger": ["生气", "发火", "angry", "be angry"],
+    "eye_surprise": ["吃惊", "surprise", "surprised", "be surprised"],
+    "eye_left": ["往左看", "看左边", "look left"],
+    "eye_right": ["往右看", "看右边", "look right"],
+    "head_left": ["向左转", "往左转", "头向左", "turn left", "head left"],
+    "head_right": ["向右转", "往右转", "头向右", "turn right", "head right"],
+    "head_up": ["往上看", "向上看", "look up", "head up"],
+    "head_down": ["往下看", "向下看", "look down", "head down"],
+    "head_nod": ["点点头", "nod", "nod your head", "nod head"],
+    "head_shake": ["摇摇头", "shake", "shake your head", "shake head"],
+    "head_roll_left": ["向左转圈", "roll left"],
+    "head_roll_right": ["向右转圈", "转圈", "转个圈", "roll right", "roll"],
+    "head_center": ["回正", "回到中间", "看前面", "看着我", "center", "look at me", "look forward"],
+}
+
+# 礼貌用语和连接词不影响意图, 计算置信度时不算在内
+filler_words = ["请你", "请", "麻烦", "帮我", "给我", "一下", "吧", "呀", "啊", "哦", "嘛", "然后", "再", "并且", "和", "先",
+                "please", "can you", "could you", "now", "then", "and", "a bit", "again", "your head"]
+
+# 含否定或疑问的句子交给 LLM, 例如 "不要点头", "你会摇头吗"
+negation_re = re.compile(r"不要|别|不用|吗|？|\?|\b(don't|do not|not|no|stop|can't|how|why|what)\b")
+
+# 回复用预先合成过的固定短语, 播放时直接命中语音缓存
+default_answer = "好的主人"
+
+
+def _pattern(phrase):
+    phrase = re.escape(phrase)
+    # 英文短语按单词匹配, 避免 "nod" 匹配到 "nodding" 之类的词
+    if phrase[0].isascii() and phrase[0].isalpha():
+        phrase = r"(?<![a-z])" + phrase
+    if phrase[-1].isascii() and phrase[-1].isalpha():
+        phrase = phrase + r"(?![a-z])"
+    return phrase
+
+
+class IntentMatcher(object):
+    """Answer simple commands ("点头", "please blink and nod") locally. The whole
+    instruction must be covered by known action phrases (fillers and punctuation aside):
+    confidence is the covered share of the remaining characters, and only answers at or
+    above threshold skip the LLM."""
+
+    def __init__(self, threshold=0.8, path=None, answer=default_answer):
+        self.threshold = threshold
+        self.answer = answer
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # 置信度按 0.1 分桶统计, 用于调整阈值
+        self.confidences = Counter()
+        table = {}
+        for label, action in eye_button_list + head_button_list:
+            table.setdefault(action, []).extend([label, action, action.replace("_", " ")])
+        for action, phrases in synonyms.items():
+            table.setdefault(action, []).extend(phrases)
+        if path and os.path.exists(path):
+            self.load(path, table)
+        self.build(table)
+
+    def load(self, path, table):
+        try:
+            with open(path, 'r', encoding='utf-8') as fp:
+                for action, phrases in json.load(fp).items():
+                    table.setdefault(action, []).extend(phrases)
+        except Exception as e:
+            error(e, f"Failed to load intent synonyms {path}")
+
+    def build(self, table):
+        self.phrases = {}
+        for action, phrases in table.items():
+            for phrase in phrases:
+                self.phrases[self.normalize(phrase)] = action
+        # 长短语优先, "向左环绕" 不会被拆成 "向左" + "环绕"
+        ordered = sorted(self.phrases, key=len, reverse=True)
+        self.phrase_re = re.compile("|".join(_pattern(p) for p in ordered))
+        self.filler_re = re.compile("|".join(_pattern(w) for w in sorted(filler_words, key=len, reverse=True)))
+
+    @staticmethod
+    def normalize(text):
+        return " ".join(text.lower().replace("_", " ").split())
+
+    def match(self, text):
+        """Return (actions, confidence) for an instruction."""
+        text = self.normalize(text)
+        if not text or negation_re.search(text):
+            return [], 0.0
+        actions = []
+        covered = 0
+        for m in self.phrase_re.finditer(text):
+            actions.append(self.phrases[m.group()])
+            covered += len(m.group().replace(" ", ""))
+        if not actions:
+            return [], 0.0
+        rest = self.filler_re.sub("", self.phrase_re.sub("", text))
+        rest = re.sub(r"[\W_]", "", rest)
+        return actions, covered / (covered + len(rest))
+
+    def respond(self, text):
+        """Return a GPT.chat style JSON response when the instruction is matched confidently,
+        otherwise None."""
+        actions, confidence = self.match(text)
+        hit = confidence >= self.threshold
+        with self.lock:
+            self.confidences[min(int(confidence * 10), 9) / 10] += 1
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not hit:
+            if actions:
+                logger.debug(f"Intent below threshold ({confidence:.2f}): {text} -> {actions}")
+            return None
+        logger.info(f"Intent hit ({confidence:.2f}): {text} -> {actions}, {self.stats}")
+        return json.dumps({"answer": self.answer, "actions": actions}, ensure_ascii=False)
+
+    @property
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "confidences": dict(sorted(self.confidences.items())),
+            }
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    matcher = IntentMatcher(path="intents.json")
+    for text in sys.argv[1:] or ["点头", "请点点头然后眨眼", "please nod", "nod your head and blink", "不要点头",
+                                 "你会摇头吗", "给我讲个笑话", "向左看一下"]:
+        start_time = time.perf_counter()
+        actions, confidence = matcher.match(text)
+        elapsed = (time.perf_counter() - start_time) * 1e6
+        print(f"{text:<28}{confidence:>6.2f}{elapsed:>8.0f} us   {actions}")
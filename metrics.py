@@ -0,0 +1,243 @@
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+from common import *
+
+
+PREFIX = "desk_emoji"
+# 直方图分桶 (秒), 从串口确认到整轮对话都能覆盖
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+
+class Turn(object):
+    """One chat turn: an ID that goes into the log lines, and the duration of each stage."""
+
+    def __init__(self, metrics, source="text"):
+        self.metrics = metrics
+        self.id = uuid.uuid4().hex[:8]
+        self.source = source
+        self.started_at = time.time()
+        self.spans = []  # (stage, seconds)
+        self.finished = False
+
+    def add(self, stage, seconds):
+        self.spans.append((stage, seconds))
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        self.metrics.finish_turn(self)
+
+    def to_dict(self):
+        return {"id": self.id, "source": self.source, "started_at": round(self.started_at, 3),
+                "spans": [{"stage": stage, "seconds": round(seconds, 4)} for stage, seconds in self.spans]}
+
+
+class Metrics(object):
+    """In-process counters and histograms for every chat turn. Stages are timed with
+    span(stage); the result can be scraped in Prometheus text format from serve(port) or
+    written to a JSON file every few seconds by start_flush(path)."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, recent_turns=50):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.gauges = {}  # (name, labels) -> value
+        self.recent = deque(maxlen=recent_turns)
+        self.local = threading.local()
+        self.started_at = time.time()
+        self.server = None
+        self.flusher = None
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name, seconds, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def start_turn(self, source="text"):
+        """Start a turn and make it the current turn of this thread."""
+        turn = Turn(self, source)
+        self.local.turn = turn
+        self.inc("turns_total", source=source)
+        return turn
+
+    def current_turn(self):
+        return getattr(self.local, "turn", None)
+
+    def attach(self, turn):
+        """Make a turn started on another thread the current turn of this thread."""
+        self.local.turn = turn
+
+    def finish_turn(self, turn):
+        seconds = time.time() - turn.started_at
+        self.observe("turn_seconds", seconds, source=turn.source)
+        with self.lock:
+            self.recent.append(turn.to_dict())
+        if self.current_turn() is turn:
+            self.local.turn = None
+        stages = ", ".join(f"{stage} {spent * 1000:.0f} ms" for stage, spent in turn.spans)
+        logger.info(f"[{turn.id}] Turn finished in {seconds:.2f} s" + (f": {stages}" if stages else ""))
+
+    def record(self, stage, seconds, turn=None):
+        """Record a stage timed elsewhere."""
+        self.observe("stage_seconds", seconds, stage=stage)
+        turn = turn or self.current_turn()
+        if turn is not None:
+            turn.add(stage, seconds)
+
+    @contextmanager
+    def span(self, stage, turn=None):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start_time, turn)
+
+    def _labels(self, labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+    def render_prometheus(self):
+        lines = []
+        with self.lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {PREFIX}_{name} counter")
+                    typed.add(name)
+                lines.append(f"{PREFIX}_{name}{self._labels(labels)} {value}")
+            for (name, labels), value in sorted(self.gauges.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {PREFIX}_{name} gauge")
+                    typed.add(name)
+                lines.append(f"{PREFIX}_{name}{self._labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {PREFIX}_{name} histogram")
+                    typed.add(name)
+                for bound, count in histogram.cumulative():
+                    lines.append(f"{PREFIX}_{name}_bucket{self._labels(labels, [('le', bound)])} {count}")
+                lines.append(f"{PREFIX}_{name}_bucket{self._labels(labels, [('le', '+Inf')])} {histogram.count}")
+                lines.append(f"{PREFIX}_{name}_sum{self._labels(labels)} {histogram.sum:.6f}")
+                lines.append(f"{PREFIX}_{name}_count{self._labels(labels)} {histogram.count}")
+        lines.append(f"# TYPE {PREFIX}_uptime_seconds gauge")
+        lines.append(f"{PREFIX}_uptime_seconds {time.time() - self.started_at:.0f}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "host": socket.gethostname(),
+                "time": time.time(),
+                "uptime": round(time.time() - self.started_at, 1),
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in self.counters.items()],
+                "gauges": [{"name": name, "labels": dict(labels), "value": value}
+                           for (name, labels), value in self.gauges.items()],
+                "histograms": [{"name": name, "labels": dict(labels), "count": h.count, "sum": round(h.sum, 6),
+                                "buckets": {str(bound): count for bound, count in h.cumulative()}}
+                               for (name, labels), h in self.histograms.items()],
+                "recent_turns": list(self.recent),
+            }
+
+    def flush(self, path):
+        try:
+            directory = os.path.dirname(path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as fp:
+                json.dump(self.snapshot(), fp, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            error(e, f"Failed to write metrics {path}")
+
+    def start_flush(self, path, interval=10.0):
+        """Write a JSON snapshot to path every interval seconds from a daemon thread."""
+        def run():
+            while True:
+                time.sleep(interval)
+                self.flush(path)
+
+        self.flusher = threading.Thread(target=run, daemon=True)
+        self.flusher.start()
+        atexit.register(self.flush, path)
+
+    def serve(self, port=9464, host="127.0.0.1"):
+        """Serve /metrics in Prometheus text format from a daemon thread. Only local by
+        default, pass host="0.0.0.0" to let a Prometheus on another machine scrape it."""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] == "/metrics.json":
+                    body, content_type = json.dumps(metrics.snapshot()).encode('utf-8'), "application/json"
+                else:
+                    body, content_type = metrics.render_prometheus().encode('utf-8'), "text/plain; version=0.0.4"
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        logger.info(f"Metrics on http://{host}:{self.server.server_address[1]}/metrics")
+        return self.server.server_address[1]
+
+
+# 全局指标, 各模块直接记录
+metrics = Metrics()
@@ -0,0 +1,245 @@
+import io
+import json
+import random
+import re
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from common import *
+
+
+# 模型的原始输出, 依次轮流返回
+default_responses = [
+    {"answer": "好的主人", "actions": ["heart", "eye_happy", "head_nod", "head_center", "eye_blink"]},
+    {"answer": "哇哦，今天真开心！我们一起玩吧。", "actions": ["laugh", "head_left", "eye_left", "head_center", "head_right",
+                                                "eye_right", "head_center", "eye_blink"]},
+    {"answer": "让我想一想，这个问题有点难。", "actions": ["thinking", "eye_surprise", "delay", "head_shake", "head_center"]},
+]
+
+# 流式输出时的 token 切分: 一个汉字或最多四个其他字符
+_token_re = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]|[^\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]{1,4}")
+
+
+def silence_wav(seconds, sample_rate=16000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(b'\x00\x00' * int(seconds * sample_rate))
+    return buffer.getvalue()
+
+
+class MockProvider(object):
+    """Behaviour of the stand-in server: time to first byte (latency + uniform jitter),
+    token rate of the chat completions, and the share of requests answered with an
+    injected HTTP error."""
+
+    def __init__(self, latency=0.3, jitter=0.0, token_rate=50.0, stream=True, error_rate=0.0,
+                 error_codes=(429, 500, 503), tts_latency=0.2, asr_latency=0.3, transcript="给我讲个笑话",
+                 responses=None, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.token_rate = token_rate
+        self.stream = stream
+        self.error_rate = error_rate
+        self.error_codes = error_codes
+        self.tts_latency = tts_latency
+        self.asr_latency = asr_latency
+        self.transcript = transcript
+        self.responses = responses or default_responses
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.errors = 0
+        self.turn = 0
+
+    def wait(self, latency):
+        with self.lock:
+            delay = latency + self.random.uniform(0, self.jitter)
+        time.sleep(delay)
+
+    def count(self, endpoint):
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            if self.random.random() < self.error_rate:
+                self.errors += 1
+                return self.random.choice(self.error_codes)
+        return None
+
+    def next_content(self):
+        with self.lock:
+            response = self.responses[self.turn % len(self.responses)]
+            self.turn += 1
+        return json.dumps(response, ensure_ascii=False)
+
+    @property
+    def stats(self):
+        with self.lock:
+            return {"requests": dict(self.requests), "errors": self.errors}
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def provider(self):
+        return self.server.provider
+
+    def log_message(self, format, *args):
+        logger.debug(f"Mock server: {format % args}")
+
+    def _send(self, status, body, content_type="application/json"):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status):
+        self._send(status, {"error": {"message": f"Injected error {status}", "type": "mock_error", "code": status}})
+
+    def _read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        self._send(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+
+    def do_POST(self):
+        body = self._read_body()
+        path = self.path.split("?")[0]
+        if path.endswith("/chat/completions"):
+            self.chat_completions(json.loads(body or b"{}"))
+        elif path.endswith("/audio/speech"):
+            self.audio_speech(json.loads(body or b"{}"))
+        elif path.endswith("/audio/transcriptions"):
+            self.audio_transcriptions()
+        else:
+            self._send(404, {"error": {"message": f"Unknown endpoint {path}"}})
+
+    def chat_completions(self, request):
+        status = self.provider.count("chat")
+        self.provider.wait(self.provider.latency)
+        if status:
+            self._send_error(status)
+            return
+        content = self.provider.next_content()
+        tokens = _token_re.findall(content)
+        model = request.get("model", "mock")
+        if request.get("stream") and self.provider.stream:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for token in tokens:
+                chunk = {"object": "chat.completion.chunk", "model": model,
+                         "choices": [{"index": 0, "delta": {"content": token}}]}
+                self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+                if self.provider.token_rate:
+                    time.sleep(1 / self.provider.token_rate)
+            self._write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            return
+        if self.provider.token_rate:
+            time.sleep(len(tokens) / self.provider.token_rate)
+        self._send(200, {
+            "object": "chat.completion", "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+        })
+
+    def _write_chunk(self, text):
+        data = text.encode('utf-8')
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def audio_speech(self, request):
+        status = self.provider.count("speech")
+        self.provider.wait(self.provider.tts_latency)
+        if status:
+            self._send_error(status)
+            return
+        # 每个字约 0.2 秒的静音
+        self._send(200, silence_wav(0.2 * len(request.get("input", ""))), "audio/wav")
+
+    def audio_transcriptions(self):
+        status = self.provider.count("transcriptions")
+        self.provider.wait(self.provider.asr_latency)
+        if status:
+            self._send_error(status)
+            return
+        self._send(200, {"text": self.provider.transcript})
+
+
+class MockServer(object):
+    """Local OpenAI-compatible stand-in for the chat, TTS and ASR endpoints."""
+
+    def __init__(self, provider=None, host="127.0.0.1", port=0):
+        self.provider = provider or MockProvider()
+        self.httpd = ThreadingHTTPServer((host, port), MockRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.provider = self.provider
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def chat_url(self):
+        return f"{self.url}/chat/completions"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        logger.info(f"Mock server listening on {self.url}")
+        return self.url
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="OpenAI-compatible mock of the chat, TTS and ASR endpoints")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.3, help="chat time to first byte in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--token-rate", type=float, default=50.0, help="generated tokens per second, 0 for instant")
+    parser.add_argument("--no-stream", action="store_true", help="answer stream requests with one JSON response")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--tts-latency", type=float, default=0.2)
+    parser.add_argument("--asr-latency", type=float, default=0.3)
+    args = parser.parse_args()
+
+    provider = MockProvider(latency=args.latency, jitter=args.jitter, token_rate=args.token_rate,
+                            stream=not args.no_stream, error_rate=args.error_rate,
+                            tts_latency=args.tts_latency, asr_latency=args.asr_latency)
+    server = MockServer(provider, port=args.port)
+    print(server.chat_url, flush=True)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        logger.info(f"Mock server stats: {provider.stats}")
@@ -0,0 +1,162 @@
+import re
+from functools import lru_cache
+
+from common import *
+
+
+# English descriptions of every firmware function, the names themselves come from the button lists
+function_descriptions = {
+    "eye_blink": "Blink",
+    "eye_happy": "Happy",
+    "eye_sad": "Sad",
+    "eye_anger": "Angry",
+    "eye_surprise": "Surprised",
+    "eye_left": "Look left",
+    "eye_right": "Look right",
+    "head_left": "Head turn left by 45 degrees",
+    "head_right": "Head turn right by 45 degrees",
+    "head_up": "Head look up by 45 degrees",
+    "head_down": "Head look down by 45 degrees",
+    "head_nod": "Nod",
+    "head_shake": "Shake head",
+    "head_roll_left": "Head roll to left",
+    "head_roll_right": "Head roll to right",
+    "head_center": "Head back to center",
+    "delay": "Delay for 1 second",
+}
+
+prompt_examples = [
+    ("Please nod.", {"answer": "好的主人", "actions": ["heart", "eye_happy", "head_nod", "head_center", "eye_blink"]}),
+    ("Please shake your head.", {"answer": "哇哦", "actions": ["puzzled", "eye_surprise", "delay", "head_shake", "head_center", "eye_blink"]}),
+    ("Smile.", {"answer": "今天真开心", "actions": ["laugh", "head_left", "eye_left", "head_center", "head_right", "eye_right", "head_center", "eye_blink"]}),
+]
+
+# 级别越低 prompt 越短、延迟和费用越低, 动作编排质量也可能随之下降
+PROMPT_LEVELS = {
+    "full": "hand-written llm_prompt, largest",
+    "standard": "generated, every function described, all rules",
+    "compact": "generated, names only, condensed rules, one example",
+    "minimal": "generated, names and output schema only",
+}
+DEFAULT_PROMPT_LEVEL = "standard"
+
+
+def eye_functions():
+    return [cmd for _, cmd in eye_button_list]
+
+
+def head_functions():
+    return [cmd for _, cmd in head_button_list] + ["delay"]
+
+
+def _example_lines(count):
+    return [f"{instruction} -> {json.dumps(response, ensure_ascii=False, separators=(',', ':'))}"
+            for instruction, response in prompt_examples[:count]]
+
+
+def _full_prompt():
+    # 原有 prompt 以"当前指令"结尾, 放入 system 角色时去掉这一行
+    return llm_prompt.rsplit("## My current instruction is:", 1)[0].rstrip() + "\n"
+
+
+def _standard_prompt():
+    lines = ["## Emoji functions"]
+    lines += [f"{function_descriptions.get(cmd, cmd)}: {cmd}" for cmd in eye_functions()]
+    lines += ["", "## Animation functions", ", ".join(animations_list), "", "## Head functions"]
+    lines += [f"{function_descriptions.get(cmd, cmd)}: {cmd}" for cmd in head_functions()]
+    lines += [
+        "",
+        "## Output",
+        'Output raw JSON only, without ``` fences: {"answer": "...", "actions": [...]}',
+        "- answer: a short, humorous, kind, playful and interesting first-person reply in Chinese, based on my instruction and your actions.",
+        "- actions: a short list of function names (strings) that vividly expresses the emotion of answer.",
+        "- Exactly one animation function, the one most relevant to answer, and it must be the first action.",
+        "- Emoji functions generally precede head functions, except eye_left/eye_right which follow head_left/head_right.",
+        "- More than 6 head movements. Head must go back to head_center after each turn.",
+        "- Nod means yes, shake means no, head roll rotates the head up, down, left and right in circles.",
+        '- The last two actions are always "head_center", "eye_blink".',
+        "",
+        "## Examples",
+    ]
+    lines += _example_lines(len(prompt_examples))
+    return "\n".join(lines) + "\n"
+
+
+def _compact_prompt():
+    lines = [
+        f"Emoji: {','.join(eye_functions())}",
+        f"Animation: {','.join(animations_list)}",
+        f"Head: {','.join(head_functions())}",
+        'Reply raw JSON {"answer": short playful Chinese first-person reply, "actions": [names]}.',
+        'actions: one animation first, emoji before head moves, >6 head moves, head_center after each turn, end with "head_center","eye_blink".',
+        "Example:",
+    ]
+    lines += _example_lines(1)
+    return "\n".join(lines) + "\n"
+
+
+def _minimal_prompt():
+    names = eye_functions() + animations_list + head_functions()
+    return ('Reply raw JSON {"answer": short Chinese reply, "actions": [names]}, '
+            f"first action one animation, last head_center,eye_blink. Names: {','.join(names)}\n")
+
+
+_builders = {
+    "full": _full_prompt,
+    "standard": _standard_prompt,
+    "compact": _compact_prompt,
+    "minimal": _minimal_prompt,
+}
+
+
+@lru_cache(maxsize=None)
+def build_system_prompt(level=DEFAULT_PROMPT_LEVEL):
+    """Static system prompt (role + function vocabulary + rules), identical on every turn so
+    that providers with prefix caching can reuse it."""
+    if level not in _builders:
+        raise ValueError(f"Unknown prompt level: {level}, choose from {', '.join(_builders)}")
+    return llm_role.strip() + "\n\n" + _builders[level]()
+
+
+_token_re = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]|[A-Za-z]+|\d+|[^\sA-Za-z\d]")
+
+
+def count_tokens(text):
+    """Token count with tiktoken when installed, otherwise a BPE-like estimate
+    (one token per CJK character / punctuation mark, about 4 letters per token)."""
+    try:
+        import tiktoken
+        return len(tiktoken.get_encoding("cl100k_base").encode(text))
+    except ImportError:
+        pass
+    tokens = 0
+    for piece in _token_re.findall(text):
+        tokens += (len(piece) + 3) // 4 if piece.isascii() and piece.isalnum() else 1
+    return tokens
+
+
+@lru_cache(maxsize=None)
+def system_prompt_tokens(level=DEFAULT_PROMPT_LEVEL):
+    return count_tokens(build_system_prompt(level))
+
+
+def report():
+    rows = []
+    for level in _builders:
+        prompt = build_system_prompt(level)
+        rows.append({"level": level, "chars": len(prompt), "tokens": count_tokens(prompt),
+                     "description": PROMPT_LEVELS[level]})
+    return rows
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Show the generated system prompt variants and their sizes")
+    parser.add_argument("--show", choices=list(_builders), help="print the prompt of this level")
+    args = parser.parse_args()
+
+    if args.show:
+        print(build_system_prompt(args.show))
+    for row in report():
+        print(f"{row['level']:<10}{row['tokens']:>6} tokens{row['chars']:>7} chars   {row['description']}")
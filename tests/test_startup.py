@@ -0,0 +1,36 @@
+import os
+import subprocess
+import sys
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+class StartupTest(unittest.TestCase):
+    """`import main` stays within STARTUP_BUDGET and leaves the window toolkit unloaded."""
+
+    def import_main(self):
+        code = ("import sys, main; "
+                "print(' '.join(m for m in ('customtkinter', 'PIL', 'tkinter', 'window') if m in sys.modules))")
+        start_time = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+        seconds = time.perf_counter() - start_time
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return seconds, result.stdout.split()
+
+    def test_import_budget(self):
+        from main import STARTUP_BUDGET
+
+        # 取三次中最快的一次, 避免偶尔的磁盘缓存抖动
+        seconds = min(self.import_main()[0] for _ in range(3))
+        self.assertLess(seconds, STARTUP_BUDGET, f"cold import of main took {seconds:.2f} s")
+
+    def test_window_imported_lazily(self):
+        _, loaded = self.import_main()
+        self.assertEqual(loaded, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,237 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from common import *
+from metrics import metrics
+
+
+class TurnOrchestrator(object):
+    """Play the speech and the motion of one chat turn side by side instead of one after
+    the other. Synthesis and action dispatch start together once the response is parsed,
+    and the first motion is held (at most max_hold seconds) until the first sentence is
+    ready, so that the robot starts moving when it starts talking."""
+
+    def __init__(self, speaker, dispatch, max_hold=1.5):
+        self.speaker = speaker
+        self.dispatch = dispatch
+        self.max_hold = max_hold
+        self.last_report = {}
+
+    def run(self, answer, actions, voice="onyx", speak=True):
+        start_time = time.time()
+        audio_started = threading.Event()
+        playback = None
+        if speak and answer:
+            playback = self.speaker.say_stream(answer, voice=voice, on_start=audio_started.set)
+        if playback is None:
+            audio_started.set()
+        else:
+            # 合成失败时不再等待声音
+            playback.add_done_callback(lambda future: audio_started.set())
+
+        motion_start = None
+        dispatch_time = 0.0
+        if actions:
+            audio_started.wait(self.max_hold)
+            motion_start = time.time()
+            try:
+                self.dispatch(actions)
+            except Exception as e:
+                error(e, "Send actions Failed")
+            dispatch_time = time.time() - motion_start
+
+        speech = playback.result() if playback is not None else {}
+        synth_time = sum(speech.get("synth", []))
+        audio_time = speech.get("audio", 0.0)
+        skew = None
+        if motion_start is not None and "first_audio" in speech:
+            skew = motion_start - start_time - speech["first_audio"]
+
+        self.last_report = {
+            "wall": time.time() - start_time,
+            "serial": synth_time + audio_time + dispatch_time,
+            "synth": synth_time,
+            "playback": audio_time,
+            "dispatch": dispatch_time,
+            "first_audio": speech.get("first_audio"),
+            "skew": skew,
+        }
+        logger.info("Turn took {wall:.2f} s against {serial:.2f} s serial "
+                    "(synth {synth:.2f} s, playback {playback:.2f} s, dispatch {dispatch:.2f} s)".format(**self.last_report))
+        metrics.record("dispatch", dispatch_time)
+        if speech:
+            metrics.record("playback", audio_time)
+            if speech.get("first_audio") is not None:
+                metrics.record("first_audio", speech["first_audio"])
+        if skew is not None:
+            logger.debug(f"First motion {skew * 1000:+.0f} ms from first audio")
+        return self.last_report
+
+
+class TurnCancelled(Exception):
+    """The turn was dropped from the queue or cancelled while running ("superseded",
+    "overflow" or "shutdown")."""
+
+    def __init__(self, reason):
+        super().__init__(f"Turn {reason}")
+        self.reason = reason
+
+
+class TurnTicket(object):
+
+    def __init__(self, key, args, kwargs, turn=None):
+        self.key = key
+        self.args = args
+        self.kwargs = kwargs
+        self.turn = turn
+        self.future = Future()
+        self.cancelled = threading.Event()
+        self.reason = ""
+        self.submitted_at = time.time()
+
+    def cancel(self, reason):
+        if not self.cancelled.is_set():
+            self.reason = reason
+            self.cancelled.set()
+
+
+class TurnExecutor(object):
+    """Run chat turns with a bounded queue and at most concurrency turns at a time, instead
+    of one thread per message. An instruction equal to one already queued or running is
+    coalesced into it (same Future). With supersede a new instruction drops every queued
+    turn and cancels the running ones: their LLM request finishes, but run() should call
+    check() before speaking or moving, and the Future fails with TurnCancelled. When the
+    queue is full the oldest queued turn is dropped."""
+
+    def __init__(self, run, max_pending=4, concurrency=1, supersede=False, name="turn"):
+        self.run = run
+        self.max_pending = max_pending
+        self.concurrency = concurrency
+        self.supersede = supersede
+        self.name = name
+        self.condition = threading.Condition()
+        self.pending = deque()
+        self.running = []
+        self.workers = []
+        self.local = threading.local()
+        self.closed = False
+        self.completed = 0
+        self.coalesced = 0
+        self.dropped = {}
+
+    @staticmethod
+    def normalize(key):
+        return " ".join(str(key).lower().split())
+
+    def submit(self, key, *args, turn=None, **kwargs):
+        """Queue run(*args, **kwargs), returns a concurrent Future of its result. key (the
+        instruction text) identifies duplicates; turn is a metrics Turn started elsewhere,
+        e.g. before recording."""
+        key = self.normalize(key)
+        with self.condition:
+            if self.closed:
+                raise RuntimeError(f"{self.name} executor is closed")
+            for ticket in list(self.pending) + self.running:
+                if ticket.key == key and not ticket.cancelled.is_set():
+                    self.coalesced += 1
+                    metrics.inc("turns_coalesced_total", executor=self.name)
+                    logger.info(f"Coalesced duplicate instruction: {key}")
+                    if turn is not None:
+                        turn.finish()
+                    return ticket.future
+            if self.supersede:
+                while self.pending:
+                    self._drop(self.pending.popleft(), "superseded")
+                for ticket in self.running:
+                    ticket.cancel("superseded")
+            while len(self.pending) >= self.max_pending:
+                self._drop(self.pending.popleft(), "overflow")
+            ticket = TurnTicket(key, args, kwargs, turn)
+            self.pending.append(ticket)
+            self._update_gauges()
+            if len(self.workers) < self.concurrency:
+                worker = threading.Thread(target=self._work, daemon=True, name=f"{self.name}-{len(self.workers)}")
+                self.workers.append(worker)
+                worker.start()
+            self.condition.notify()
+        return ticket.future
+
+    def _drop(self, ticket, reason):
+        ticket.cancel(reason)
+        self.dropped[reason] = self.dropped.get(reason, 0) + 1
+        metrics.inc("turns_dropped_total", executor=self.name, reason=reason)
+        logger.info(f"Dropped queued turn ({reason}): {ticket.key}")
+        if ticket.turn is not None:
+            ticket.turn.finish()
+        ticket.future.set_exception(TurnCancelled(reason))
+
+    def _update_gauges(self):
+        metrics.set("turn_queue_depth", len(self.pending), executor=self.name)
+        metrics.set("turns_running", len(self.running), executor=self.name)
+
+    def _work(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                ticket = self.pending.popleft()
+                self.running.append(ticket)
+                self._update_gauges()
+            metrics.observe("turn_queue_seconds", time.time() - ticket.submitted_at, executor=self.name)
+            self.local.ticket = ticket
+            if ticket.turn is not None:
+                metrics.attach(ticket.turn)
+            try:
+                result = self.run(*ticket.args, **ticket.kwargs)
+                if ticket.cancelled.is_set():
+                    raise TurnCancelled(ticket.reason)
+                ticket.future.set_result(result)
+            except TurnCancelled as e:
+                self.dropped[e.reason] = self.dropped.get(e.reason, 0) + 1
+                metrics.inc("turns_dropped_total", executor=self.name, reason=e.reason)
+                logger.info(f"Cancelled running turn ({e.reason}): {ticket.key}")
+                ticket.future.set_exception(e)
+            except Exception as e:
+                error(e, "Turn Failed")
+                ticket.future.set_exception(e)
+            finally:
+                if ticket.turn is not None:
+                    ticket.turn.finish()
+                self.local.ticket = None
+                with self.condition:
+                    self.running.remove(ticket)
+                    self.completed += 1
+                    self._update_gauges()
+
+    def cancelled(self):
+        """Whether the turn running on this thread has been superseded."""
+        ticket = getattr(self.local, "ticket", None)
+        return ticket is not None and ticket.cancelled.is_set()
+
+    def check(self):
+        """Raise TurnCancelled in run() once its turn has been superseded."""
+        ticket = getattr(self.local, "ticket", None)
+        if ticket is not None and ticket.cancelled.is_set():
+            raise TurnCancelled(ticket.reason)
+
+    def shutdown(self):
+        with self.condition:
+            self.closed = True
+            while self.pending:
+                self._drop(self.pending.popleft(), "shutdown")
+            self.condition.notify_all()
+
+    @property
+    def stats(self):
+        with self.condition:
+            return {
+                "queued": len(self.pending),
+                "running": len(self.running),
+                "completed": self.completed,
+                "coalesced": self.coalesced,
+                "dropped": dict(self.dropped),
+            }